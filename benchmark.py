@@ -0,0 +1,173 @@
+"""
+Training throughput benchmark of the registered models on synthetic data.
+
+Usage:
+    python benchmark.py --models wgan ganomaly-small --batchsizes 32 64 --output bench.json
+    python benchmark.py --models wgan --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import resource
+import platform
+import multiprocessing
+
+import numpy as np
+
+
+def build_synthetic_dataset(input_shape, n_data=1024, n_classes=10):
+    from datasets.datasets import ConditionalDataset
+
+    dataset = ConditionalDataset(name='synthetic')
+    dataset.images = np.random.randint(0, 256, size=(n_data,) + tuple(input_shape)).astype('uint8')
+    dataset.attrs = np.eye(n_classes, dtype='float32')[np.random.randint(n_classes, size=n_data)]
+    dataset.x_test, dataset.y_test = dataset.images[:100], np.argmax(dataset.attrs[:100], axis=1)
+    dataset.attr_names = [str(c) for c in range(n_classes)]
+    return dataset
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / 1024. ** 2 if sys.platform == 'darwin' else peak / 1024.
+
+
+def benchmark_model(model_name, dataset, batchsizes, warmup=5, steps=20, **model_options):
+    """
+    Times train_on_batch of a model on batches of the synthetic dataset for
+    each batch size. Returns {batchsize: stats}.
+    """
+    import models
+
+    output = tempfile.mkdtemp(prefix='benchmark_')
+    model = models.get_model_by_name(model_name)(input_shape=dataset.shape[1:], output=output,
+                                                 run_id='benchmark', **model_options)
+    model.dataset = dataset
+
+    results = {}
+    for batchsize in batchsizes:
+        model.batchsize = batchsize
+        batches = dataset.get_epoch_batches(batchsize)
+        if not batches:
+            raise ValueError("The synthetic dataset is smaller than a batch of {}".format(batchsize))
+        latencies = []
+        for step in range(warmup + steps):
+            x_batch, y_batch = dataset.make_batch(batches[step % len(batches)][0])
+            start = time.perf_counter()
+            model.train_on_batch(x_batch, y_batch=y_batch)
+            if step >= warmup:
+                latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies)
+        p50, p90, p99 = np.percentile(latencies * 1e3, [50, 90, 99])
+        results[str(batchsize)] = {
+            'images_per_sec': batchsize * steps / latencies.sum(),
+            'latency_ms_p50': p50,
+            'latency_ms_p90': p90,
+            'latency_ms_p99': p99,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        print("[Benchmark] {} bs={}: {:.1f} img/s, p50 {:.1f}ms, p99 {:.1f}ms".format(
+            model_name, batchsize, results[str(batchsize)]['images_per_sec'], p50, p99))
+    return results
+
+
+def benchmark_model_in_process(model_name, options):
+    """
+    Entry point of the processes benchmarking one model each, so that the
+    peak memory they report is that of this model alone
+    """
+    np.random.seed(0)
+    dataset = build_synthetic_dataset(options['input_shape'], n_data=max(options['batchsizes']) * 4)
+    return benchmark_model(model_name, dataset, options['batchsizes'], warmup=options['warmup'],
+                           steps=options['steps'], z_dims=options['z_dims'], test_mode=True)
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Lists the (model, batchsize) pairs of results whose images/sec dropped
+    by more than tolerance relative to baseline
+    """
+    regressions = []
+    print("{:<40}{:>6}{:>12}{:>12}{:>9}".format('model', 'bs', 'baseline', 'current', 'ratio'))
+    for model_name, runs in sorted(results['results'].items()):
+        base_runs = baseline['results'].get(model_name, {})
+        if 'error' in runs or 'error' in base_runs:
+            continue
+        for batchsize, stats in sorted(runs.items(), key=lambda r: int(r[0])):
+            if batchsize not in base_runs:
+                continue
+            base_ips, ips = base_runs[batchsize]['images_per_sec'], stats['images_per_sec']
+            ratio = ips / base_ips
+            flag = ''
+            if ratio < 1. - tolerance:
+                flag = '  SLOWER'
+                regressions.append((model_name, batchsize, ratio))
+            print("{:<40}{:>6}{:>12.1f}{:>12.1f}{:>9.2f}{}".format(model_name, batchsize, base_ips, ips, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the training throughput of models')
+    parser.add_argument('--models', type=str, nargs='+', default=None,
+                        help="models to benchmark, all the registered ones by default")
+    parser.add_argument('--input-shape', type=int, nargs=3, default=[32, 32, 3])
+    parser.add_argument('--batchsizes', type=int, nargs='+', default=[32, 64])
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--z-dims', type=int, default=128)
+    parser.add_argument('--gpu', action='store_true', help="run on the GPU instead of the CPU")
+    parser.add_argument('--output', type=str, default=None, help="json file receiving the results")
+    parser.add_argument('--baseline', type=str, default=None,
+                        help="json results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative images/sec drop reported as a slowdown")
+    args = parser.parse_args()
+
+    if not args.gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    from keras import backend as K
+    import keras
+    import models
+
+    model_names = args.models or sorted(models.models_by_name.keys())
+    # a fresh process per model, inheriting the environment set above
+    context = multiprocessing.get_context('spawn')
+
+    results = {
+        'config': {'input_shape': args.input_shape, 'batchsizes': args.batchsizes,
+                   'warmup': args.warmup, 'steps': args.steps, 'z_dims': args.z_dims,
+                   'device': 'gpu' if args.gpu else 'cpu', 'backend': K.backend(),
+                   'keras_version': keras.__version__, 'host': platform.node()},
+        'results': {},
+    }
+    for model_name in model_names:
+        try:
+            with context.Pool(1) as pool:
+                results['results'][model_name] = pool.apply(benchmark_model_in_process,
+                                                             (model_name, vars(args)))
+        except Exception as e:
+            print("[Benchmark] {} failed: {}".format(model_name, repr(e)))
+            results['results'][model_name] = {'error': repr(e)}
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, tolerance=args.tolerance)
+        if regressions:
+            print("[Benchmark] {} slowdowns beyond {:.0%}".format(len(regressions), args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
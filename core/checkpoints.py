@@ -0,0 +1,243 @@
+import os
+import json
+import shutil
+import pickle
+import atexit
+import threading
+import queue
+
+import numpy as np
+import h5py
+import keras
+from keras import backend as K
+
+
+WEIGHTS_FILENAME = 'weights.h5'
+MANIFEST_FILENAME = 'weights_manifest.json'
+
+
+def snapshot_trainers(trainers):
+    """
+    Copies the weights of every trainer to host memory in a single backend
+    call. Variables shared by several trainers (e.g. a submodel and the
+    composite trainers built from it) are copied once.
+    Returns (layout, values): layout maps each trainer to a list of
+    [layer_name, [variable keys]] and values maps each key to its array.
+    """
+    layout, keys, used_keys, variables = {}, {}, set(), []
+    for k, model in trainers.items():
+        layout[k] = []
+        for layer in model.layers:
+            layer_keys = []
+            for w in layer.weights:
+                if id(w) not in keys:
+                    # variable names are unique in a graph, but be safe
+                    key = w.name
+                    while key in used_keys:
+                        key = key + '_'
+                    keys[id(w)] = key
+                    used_keys.add(key)
+                    variables.append(w)
+                layer_keys.append(keys[id(w)])
+            layout[k].append([layer.name, layer_keys])
+    values = K.batch_get_value(variables)
+    return layout, {keys[id(w)]: v for w, v in zip(variables, values)}
+
+
+def write_checkpoint_weights(folder, layout, values):
+    """
+    Stores every variable once in an hdf5 file, next to a manifest with the
+    variables of each layer of each trainer
+    """
+    with h5py.File(os.path.join(folder, WEIGHTS_FILENAME), 'w') as f:
+        f.attrs['backend'] = K.backend().encode('utf8')
+        f.attrs['keras_version'] = str(keras.__version__).encode('utf8')
+        for key, value in values.items():
+            f.create_dataset(key, data=value)
+    with open(os.path.join(folder, MANIFEST_FILENAME), 'w') as f:
+        json.dump({'version': 1, 'trainers': layout}, f, indent=2)
+
+
+def has_checkpoint_weights(folder):
+    return os.path.exists(os.path.join(folder, MANIFEST_FILENAME))
+
+
+def load_checkpoint_weights(folder, models):
+    """
+    Loads the weights of models, a dict of trainer or submodel name to model,
+    from a checkpoint folder. As in Keras' load_weights, the layers with
+    weights are matched by their order, not by their generated names, which
+    depend on the models built before in the process. Only the variables of
+    the requested models are read from disk.
+    """
+    with open(os.path.join(folder, MANIFEST_FILENAME), 'r') as f:
+        manifest = json.load(f)
+
+    assignments = []
+    with h5py.File(os.path.join(folder, WEIGHTS_FILENAME), 'r') as f:
+        for k, model in models.items():
+            if k not in manifest['trainers']:
+                raise KeyError("Checkpoint {} has no weights for {}".format(folder, k))
+            stored_layers = [l for l in manifest['trainers'][k] if l[1]]
+            layers = [l for l in model.layers if l.weights]
+            if len(layers) != len(stored_layers):
+                raise ValueError("{} has {} layers with weights, but the checkpoint has {}".format(
+                    k, len(layers), len(stored_layers)))
+            for layer, (stored_name, layer_keys) in zip(layers, stored_layers):
+                values = [f[key][()] for key in layer_keys]
+                if (len(values) != len(layer.weights)
+                        or any(K.int_shape(w) != v.shape for w, v in zip(layer.weights, values))):
+                    raise ValueError("Layer {} of {} does not match layer {} of the checkpoint".format(
+                        layer.name, k, stored_name))
+                assignments += zip(layer.weights, values)
+    K.batch_set_value(assignments)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread. The caller only pays for
+    copying the weights to host memory; files are written to a temporary
+    folder that is renamed into place once complete, so a checkpoint folder
+    is either whole or absent.
+
+    After every write a retention policy is applied to the checkpoints made
+    by this writer (and those recorded in out_dir by previous runs):
+    keep_last: keep the latest keep_last checkpoints; None keeps them all,
+               or only the latest one if keep_every or keep_best is given
+    keep_every: also keep every keep_every-th checkpoint
+    keep_best: also keep the checkpoint with the best metric value, 'min' or
+               'max' according to best_mode
+    """
+
+    def __init__(self, out_dir, keep_last=None, keep_every=None, keep_best=False,
+                 best_mode='min', max_pending=2):
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must keep at least one checkpoint, got {}".format(keep_last))
+        if best_mode not in ('min', 'max'):
+            raise ValueError("best_mode must be 'min' or 'max', got {}".format(best_mode))
+        self.out_dir = out_dir
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.best_mode = best_mode
+        self.registry_file = os.path.join(out_dir, 'checkpoints.json')
+        self.checkpoints = self._read_registry()
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._worker)
+        self.thread.daemon = True
+        self.thread.start()
+        # pending checkpoints are still written if training exits early
+        atexit.register(self.close)
+
+    def _read_registry(self):
+        if not os.path.exists(self.registry_file):
+            return []
+        with open(self.registry_file, 'r') as f:
+            checkpoints = json.load(f)
+        for c in checkpoints:
+            # a crash while replacing a checkpoint leaves the previous one aside
+            folder = os.path.join(self.out_dir, c['folder'])
+            old_folder = os.path.join(self.out_dir, '.{}.old'.format(c['folder']))
+            if not os.path.isdir(folder) and os.path.isdir(old_folder):
+                os.rename(old_folder, folder)
+        return [c for c in checkpoints if os.path.isdir(os.path.join(self.out_dir, c['folder']))]
+
+    def _write_registry(self):
+        tmp_file = self.registry_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.checkpoints, f, indent=2)
+        os.replace(tmp_file, self.registry_file)
+
+    def save(self, folder_name, trainers, training_state=None, metric_value=None):
+        """
+        Snapshots trainers and queues the checkpoint for writing. Blocks only
+        if max_pending checkpoints are still waiting to be written.
+        metric_value may be a function, called by the writer thread, for a
+        value that is still being computed.
+        """
+        if self.error is not None:
+            raise self.error
+        layout, values = snapshot_trainers(trainers)
+        self.queue.put((folder_name, (layout, values), training_state, metric_value))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self._write(*item)
+                self._apply_retention()
+            except Exception as e:
+                print("[Checkpoint] Failed to write {}: {}".format(item[0], repr(e)))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, folder_name, weights, training_state, metric_value):
+        folder = os.path.join(self.out_dir, folder_name)
+        tmp_folder = os.path.join(self.out_dir, '.{}.tmp'.format(folder_name))
+        if os.path.isdir(tmp_folder):
+            shutil.rmtree(tmp_folder)
+        os.makedirs(tmp_folder)
+
+        write_checkpoint_weights(tmp_folder, *weights)
+        if training_state is not None:
+            with open(os.path.join(tmp_folder, 'training_state.pkl'), 'wb') as f:
+                pickle.dump(training_state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # the previous checkpoint of that name is only deleted once replaced
+        old_folder = None
+        if os.path.isdir(folder):
+            old_folder = os.path.join(self.out_dir, '.{}.old'.format(folder_name))
+            if os.path.isdir(old_folder):
+                shutil.rmtree(old_folder)
+            os.rename(folder, old_folder)
+        os.rename(tmp_folder, folder)
+        if old_folder is not None:
+            shutil.rmtree(old_folder)
+
+        self.checkpoints = [c for c in self.checkpoints if c['folder'] != folder_name]
+        index = self.checkpoints[-1]['index'] + 1 if self.checkpoints else 0
+        if callable(metric_value):
+            metric_value = metric_value()
+        if metric_value is not None:
+            metric_value = float(metric_value)
+        self.checkpoints.append({'folder': folder_name, 'index': index, 'metric': metric_value})
+        self._write_registry()
+
+    def _apply_retention(self):
+        if self.keep_last is not None:
+            keep = set(c['folder'] for c in self.checkpoints[-self.keep_last:])
+        elif self.keep_every or self.keep_best:
+            keep = set(c['folder'] for c in self.checkpoints[-1:])
+        else:
+            return
+        if self.keep_every:
+            keep.update(c['folder'] for c in self.checkpoints if c['index'] % self.keep_every == 0)
+        scored = [c for c in self.checkpoints if c['metric'] is not None and not np.isnan(c['metric'])]
+        if self.keep_best and scored:
+            pick = min if self.best_mode == 'min' else max
+            keep.add(pick(scored, key=lambda c: c['metric'])['folder'])
+
+        for c in self.checkpoints:
+            if c['folder'] not in keep:
+                shutil.rmtree(os.path.join(self.out_dir, c['folder']), ignore_errors=True)
+        self.checkpoints = [c for c in self.checkpoints if c['folder'] in keep]
+        self._write_registry()
+
+    def wait(self):
+        """
+        Blocks until every queued checkpoint is written
+        """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
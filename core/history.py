@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class History(object):
+    """
+    Append-only series of float32 values stored in a growable numpy array.
+
+    Running sums make the mean of the latest n values O(1), and downsample()
+    returns min/mean/max per bucket for plotting a bounded number of points.
+    Buckets are powers of two long and their aggregates are cached per
+    level, so each call only aggregates the values appended since the last.
+    """
+
+    def __init__(self, values=None, capacity=1024):
+        values = np.asarray(values if values is not None else [], dtype='float32')
+        capacity = max(capacity, len(values))
+        self._data = np.empty(capacity, dtype='float32')
+        self._cumsum = np.zeros(capacity + 1, dtype='float64')
+        self._count = 0
+        self._levels = {}
+        self.extend(values)
+
+    def _grow(self, needed):
+        capacity = len(self._data)
+        while capacity < needed:
+            capacity *= 2
+        data = np.empty(capacity, dtype='float32')
+        data[:self._count] = self._data[:self._count]
+        cumsum = np.zeros(capacity + 1, dtype='float64')
+        cumsum[:self._count + 1] = self._cumsum[:self._count + 1]
+        self._data, self._cumsum = data, cumsum
+
+    def append(self, value):
+        if self._count == len(self._data):
+            self._grow(self._count + 1)
+        self._data[self._count] = value
+        self._cumsum[self._count + 1] = self._cumsum[self._count] + self._data[self._count]
+        self._count += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype='float32')
+        if self._count + len(values) > len(self._data):
+            self._grow(self._count + len(values))
+        start, stop = self._count, self._count + len(values)
+        self._data[start:stop] = values
+        self._cumsum[start + 1:stop + 1] = self._cumsum[start] + np.cumsum(values, dtype='float64')
+        self._count = stop
+
+    @property
+    def values(self):
+        return self._data[:self._count]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, item):
+        return self.values[item]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    def mean_of_latest(self, n):
+        n = min(n, self._count)
+        if n == 0:
+            return np.nan
+        return (self._cumsum[self._count] - self._cumsum[self._count - n]) / n
+
+    def _aggregate_level(self, bucket):
+        """
+        Returns the cached (mins, sums, maxs) of the complete buckets of the
+        given size, extended with the buckets completed since the last call
+        """
+        mins, sums, maxs = self._levels.get(bucket, (np.empty(0, 'float32'),) * 3)
+        n_complete = self._count // bucket
+        if n_complete > len(mins):
+            new = self._data[len(mins) * bucket:n_complete * bucket].reshape(-1, bucket)
+            mins = np.concatenate([mins, new.min(axis=1)])
+            sums = np.concatenate([sums, new.sum(axis=1, dtype='float64').astype('float32')])
+            maxs = np.concatenate([maxs, new.max(axis=1)])
+            self._levels[bucket] = (mins, sums, maxs)
+        return mins, sums, maxs
+
+    def downsample(self, max_points=1000):
+        """
+        Returns (mins, means, maxs, bucket): the min, mean and max of every
+        bucket of bucket consecutive values, with at most max_points buckets.
+        A last incomplete bucket is aggregated over the values it holds.
+        """
+        if self._count <= max_points:
+            values = self.values
+            return values, values, values, 1
+        bucket = 1 << int(np.ceil(np.log2(self._count / max_points)))
+        mins, sums, maxs = self._aggregate_level(bucket)
+        means = sums / bucket
+        rest = self._data[len(mins) * bucket:self._count]
+        if len(rest):
+            mins = np.append(mins, rest.min())
+            means = np.append(means, rest.mean())
+            maxs = np.append(maxs, rest.max())
+        return mins, means, maxs, bucket
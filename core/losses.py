@@ -1,19 +1,21 @@
 import numpy as np
 from keras import backend as K
 
+from core.history import History
+
 
 class Loss(object):
 
     def __init__(self, weight=1.0, weight_control_type='none', pivot_control_epoch=1):
         self.last_value = 100.
-        self.history = []
+        self.history = History()
         self.weight = weight
         self.weight_control_type = weight_control_type
         self.pivot_control_epoch = pivot_control_epoch
         self.weight_from_last_significant_change = 0.
-        self.weight_history = []
+        self.weight_history = History()
         self.current_weight = 0.
-        self.backend = K.variable(0)
+        self.backend = K.variable(0)  # replaced by the in-graph schedule in bind_schedule
 
         allowed_weight_control_types = ['inc', 'dec', 'hold', 'halt', 'none',
                                         'hold-inc', 'hold-dec']
@@ -38,7 +40,45 @@ class Loss(object):
         else:
             raise ValueError("Wrong format for loss control string")
 
+    def bind_schedule(self, progress):
+        """
+        Makes backend the in-graph weight schedule of this loss, a function
+        of progress, a backend variable holding the training epoch fraction.
+        It matches update_weight_based_on_time for every control type.
+        """
+        w = K.constant(self.weight)
+        pivot = float(self.pivot_control_epoch)
+        after_pivot = K.cast(K.greater_equal(progress, pivot), K.floatx())
+        if self.weight_control_type == 'inc':
+            self.backend = w * K.minimum(1., progress / pivot)
+        elif self.weight_control_type == 'dec':
+            self.backend = w * (1. - K.minimum(1., progress / pivot))
+        elif self.weight_control_type == 'hold':
+            self.backend = w * after_pivot
+        elif self.weight_control_type == 'hold-inc':
+            self.backend = w * after_pivot * K.minimum(1., (progress - pivot) / pivot)
+        elif self.weight_control_type == 'hold-dec':
+            self.backend = w * after_pivot * (1. - K.minimum(1., (progress - pivot) / pivot))
+        elif self.weight_control_type == 'halt':
+            self.backend = w * (1. - after_pivot)
+        else:
+            self.backend = w
+
+    def get_schedule_end(self):
+        """
+        Epoch after which the weight schedule stays constant
+        """
+        if self.weight_control_type == 'none':
+            return 0.
+        if self.weight_control_type in ('hold-inc', 'hold-dec'):
+            return 2. * self.pivot_control_epoch
+        return float(self.pivot_control_epoch)
+
     def update_weight_based_on_time(self, current_epoch):
+        """
+        Host-side mirror of the in-graph schedule, used to keep the weight
+        history and to detect significant weight changes
+        """
         weighting_factor = np.min((1, (current_epoch) / self.pivot_control_epoch))
         new_weight = 0.0
         if self.weight_control_type == 'inc':
@@ -70,20 +110,35 @@ class Loss(object):
         elif self.weight_control_type == 'none':
             new_weight = self.weight
 
-        K.set_value(self.backend, new_weight)
         self.current_weight = new_weight
         return new_weight, np.abs(new_weight - self.weight_from_last_significant_change)
 
     def reset_weight_from_last_significant_change(self):
-        self.weight_from_last_significant_change = K.get_value(self.backend)
+        self.weight_from_last_significant_change = self.current_weight
 
     def update_history(self, new_loss):
         self.last_value = new_loss
         self.history.append(new_loss)
         self.weight_history.append(self.current_weight)
 
+    def extend_history(self, new_losses):
+        self.last_value = new_losses[-1]
+        self.history.extend(new_losses)
+        self.weight_history.extend(np.full(len(new_losses), self.current_weight, dtype='float32'))
+
     def get_mean_of_latest(self, n=1000):
-        if len(self.history) > n:
-            return np.mean(self.history[-n:])
-        else:
-            return np.mean(self.history)
+        return self.history.mean_of_latest(n)
+
+    def get_state(self):
+        return {'last_value': self.last_value,
+                'history': self.history.values.copy(),
+                'weight_history': self.weight_history.values.copy(),
+                'current_weight': self.current_weight,
+                'weight_from_last_significant_change': self.weight_from_last_significant_change}
+
+    def set_state(self, state):
+        self.last_value = state['last_value']
+        self.history = History(state['history'])
+        self.weight_history = History(state['weight_history'])
+        self.current_weight = state['current_weight']
+        self.weight_from_last_significant_change = state['weight_from_last_significant_change']
@@ -0,0 +1,122 @@
+import os
+import uuid
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+
+def get_shared_dir():
+    """
+    Folder for the arrays shared with worker processes: /dev/shm where it
+    exists, so that they live in memory, else the temporary folder
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def share_arrays(data, folder):
+    """
+    Copies the numpy arrays of data (an array or nested lists and tuples of
+    them) into memory mapped files of folder. Returns a picklable spec of
+    data to rebuild it with attach_arrays, and the files written.
+    """
+    if isinstance(data, np.ndarray) and data.dtype != object:
+        filename = os.path.join(folder, 'metric_input_{}.npy'.format(uuid.uuid4().hex))
+        shared = np.lib.format.open_memmap(filename, mode='w+', dtype=data.dtype, shape=data.shape)
+        shared[...] = data
+        shared.flush()
+        del shared
+        return ('array', filename), [filename]
+    if isinstance(data, (list, tuple)):
+        specs, files = [], []
+        for item in data:
+            spec, item_files = share_arrays(item, folder)
+            specs.append(spec)
+            files += item_files
+        return (type(data).__name__, specs), files
+    return ('object', data), []
+
+
+def attach_arrays(spec):
+    kind, value = spec
+    if kind == 'array':
+        return np.load(value, mmap_mode='r')
+    if kind == 'list':
+        return [attach_arrays(s) for s in value]
+    if kind == 'tuple':
+        return tuple(attach_arrays(s) for s in value)
+    return value
+
+
+def compute_in_worker(metric_class, spec, connection):
+    """
+    Entry point of the worker processes: computes the metric on the shared
+    inputs and sends back ('ok', result) or ('error', message)
+    """
+    try:
+        metric = metric_class.__new__(metric_class)
+        result = metric.compute(attach_arrays(spec))
+        connection.send(('ok', result))
+    except Exception as e:
+        connection.send(('error', repr(e)))
+    finally:
+        connection.close()
+
+
+class ProcessMetricExecutor(object):
+    """
+    Computes metrics in worker processes, so that CPU heavy metrics do not
+    compete with the training loop for the GIL. At most n_workers
+    computations run at once; their input arrays are written once to
+    memory mapped files under /dev/shm instead of being pickled.
+
+    A process is started per computation, forked from a forkserver that
+    has already imported preload (the metric modules), and terminated if
+    it runs longer than the timeout given to run. Only metrics flagged
+    process_safe are run here: their compute may only use its input_data.
+    """
+
+    def __init__(self, n_workers=2, preload=()):
+        self.slots = threading.BoundedSemaphore(n_workers)
+        self.shared_dir = get_shared_dir()
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(['__main__'] + list(preload))
+        else:
+            self.context = multiprocessing.get_context('spawn')
+
+    def run(self, metric, input_data, timeout=None):
+        """
+        Computes metric on input_data in a worker process, blocking the
+        calling thread until the result arrives. Raises TimeoutError if it
+        takes longer than timeout seconds and RuntimeError if it fails.
+        """
+        with self.slots:
+            spec, files = share_arrays(input_data, self.shared_dir)
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(target=compute_in_worker,
+                                           args=(type(metric), spec, sender))
+            process.daemon = True
+            try:
+                process.start()
+                sender.close()
+                if not receiver.poll(timeout):
+                    raise TimeoutError("{} took longer than {}s".format(metric.name, timeout))
+                try:
+                    status, result = receiver.recv()
+                except EOFError:
+                    raise RuntimeError("The worker computing {} died".format(metric.name))
+                if status == 'error':
+                    raise RuntimeError("{} failed in its worker: {}".format(metric.name, result))
+                return result
+            finally:
+                if process.is_alive():
+                    process.terminate()
+                if process.pid is not None:
+                    process.join()
+                receiver.close()
+                for filename in files:
+                    os.remove(filename)
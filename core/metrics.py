@@ -5,10 +5,27 @@ import numpy as np
 
 class Metric(object, metaclass=ABCMeta):
     metrics_by_name = {}
+    # compute only depends on its input, so it can run in another process
+    process_safe = False
 
     def __init__(self, **kwargs):
         self.thread = threading.Thread()
         self.thread.start()
+        self.executor = None
+        self.timeout = None
+
+    def use_executor(self, executor, timeout=None):
+        """
+        Runs the computations of the metric with executor (e.g. a
+        ProcessMetricExecutor), giving up on those longer than timeout
+        """
+        self.executor = executor
+        self.timeout = timeout
+
+    def run_compute(self, input_data):
+        if self.executor is None:
+            return self.compute(input_data)
+        return self.executor.run(self, input_data, timeout=self.timeout)
 
     def compute_in_parallel(self, input_data):
         self.thread.join()  # wait for previous computation to finish
@@ -16,6 +33,16 @@ class Metric(object, metaclass=ABCMeta):
                                        args=(input_data,))
         self.thread.start()
 
+    def get_state(self):
+        """
+        Returns what is needed to restore the metric's results so far. An
+        ongoing computation is not waited for: its result lands later.
+        """
+        return {}
+
+    def set_state(self, state):
+        pass
+
     @abstractmethod
     def computation_worker(self, input_data):
         pass
@@ -59,10 +86,15 @@ class HistoryMetric(Metric):
         super().__init__()
         self.history = []
         self.last_value = None
+        self.n_started = 0
+
+    def compute_in_parallel(self, input_data):
+        super().compute_in_parallel(input_data)
+        self.n_started += 1
 
     def computation_worker(self, input_data):
         try:
-            result = self.compute(input_data)
+            result = self.run_compute(input_data)
         except Exception as e:
             print("Exception while computing metrics: {}".format(repr(e)))
             if self.last_value is None:
@@ -72,6 +104,27 @@ class HistoryMetric(Metric):
         self.last_value = result
         self.history.append(result)
 
+    def get_state(self):
+        super().get_state()
+        return {'history': list(self.history), 'last_value': self.last_value}
+
+    def set_state(self, state):
+        self.history = list(state['history'])
+        self.last_value = state['last_value']
+        self.n_started = len(self.history)
+
+    def get_latest_value(self):
+        """
+        Returns a function giving the result of the latest computation started
+        so far, which waits for that computation to finish
+        """
+        index, thread = self.n_started - 1, self.thread
+
+        def latest_value():
+            thread.join()
+            return self.history[index] if index >= 0 else None
+        return latest_value
+
     def get_data_for_plot(self):
         return self.history
 
@@ -95,7 +148,7 @@ class ProjectionMetric(Metric):
 
     def computation_worker(self, input_data):
         try:
-            result = self.compute(input_data)
+            result = self.run_compute(input_data)
         except Exception as e:
             print("Exception while computing metrics: {}".format(repr(e)))
             if self.current_projection is None:
@@ -104,6 +157,13 @@ class ProjectionMetric(Metric):
                 result = self.current_projection
         self.current_projection = result
 
+    def get_state(self):
+        super().get_state()
+        return {'current_projection': self.current_projection}
+
+    def set_state(self, state):
+        self.current_projection = state['current_projection']
+
     def get_data_for_plot(self):
         return self.current_projection
 
@@ -127,11 +187,18 @@ class ImageSamplesMetric(Metric):
 
     def computation_worker(self, input_data):
         try:
-            result = self.compute(input_data)
+            result = self.run_compute(input_data)
         except Exception as e:
             print("Exception while computing metrics: {}".format(repr(e)))
         self.current_images = result
 
+    def get_state(self):
+        super().get_state()
+        return {'current_images': self.current_images}
+
+    def set_state(self, state):
+        self.current_images = state['current_images']
+
     def get_data_for_plot(self):
         return self.current_images
 
@@ -1,15 +1,23 @@
 import os
 import sys
 import time
+import random
+import pickle
+import inspect
+import itertools
 import threading
 import queue
 import numpy as np
 import h5py
+from keras import backend as K
 
 from abc import ABCMeta, abstractmethod
 
-from models.utils import print_current_progress, plot_metrics
+from models.utils import print_current_progress, plot_metrics, use_callable_trainer, stage_batches
 from core.losses import Loss
+from core.checkpoints import CheckpointWriter, has_checkpoint_weights, load_checkpoint_weights
+from core.profiler import StepProfiler, NullProfiler
+from core.metric_executor import ProcessMetricExecutor
 import metrics
 
 try:
@@ -24,6 +32,11 @@ class BaseModel(metaclass=ABCMeta):
     Base class for non-conditional generative networks
     '''
 
+    # upper bound of points per line in the loss plots
+    max_plot_points = 2000
+    # whether train_on_batch implements the fused_step option
+    supports_fused_step = False
+
     def __init__(self, **kwargs):
 
         if not hasattr(self, 'name'):
@@ -48,22 +61,47 @@ class BaseModel(metaclass=ABCMeta):
 
         self.output = kwargs.get('output', 'output')
         self.test_mode = kwargs.get('test_mode', False)
+        if kwargs.get('fused_step', False) and not self.supports_fused_step:
+            raise ValueError("{} does not support fused_step".format(type(self).__name__))
 
         self.trainers = {}
-        self.last_epoch = 0  # recalculated from weights filename if it is loaded later
+        self.last_epoch = 0  # restored from the training state if a checkpoint is loaded later
+        self.processed_images = 0
+        self.epoch_batches = 0
+        self.epoch_rng_state = None
+        self.resume_state = None
         self.label_smoothing = kwargs.get('label_smoothing', 0.0)
         self.input_noise = kwargs.get('input_noise', 0.0)
 
         self.checkpoint_every = kwargs.get('checkpoint_every', "1")
+        self.checkpoint_keep_last = kwargs.get('checkpoint_keep_last', None)
+        self.checkpoint_keep_every = kwargs.get('checkpoint_keep_every', None)
+        self.checkpoint_keep_best = kwargs.get('checkpoint_keep_best', None)
+        self.checkpoint_best_mode = 'min'
+        if self.checkpoint_keep_best is not None and ':' in self.checkpoint_keep_best:
+            self.checkpoint_keep_best, self.checkpoint_best_mode = self.checkpoint_keep_best.split(':', 1)
+        if self.checkpoint_best_mode not in ('min', 'max'):
+            raise ValueError("The best checkpoint is kept by 'min' or 'max', not {}".format(self.checkpoint_best_mode))
+        if self.checkpoint_keep_last is not None and self.checkpoint_keep_last < 1:
+            raise ValueError("At least one latest checkpoint must be kept")
+        self.checkpoint_writer = None
+        self.profile_every = kwargs.get('profile_every', 0)
+        self.profile_trace = kwargs.get('profile_trace', None)
         self.notify_every = kwargs.get('notify_every', self.checkpoint_every)
         self.lr = kwargs.get('lr', 1e-4)
         self.z_dims = kwargs.get('z_dims', 100)
+        self.prefetch_batches = kwargs.get('prefetch_batches', 0)
+        self.prefetch_workers = kwargs.get('prefetch_workers', 1)
+        self.staged_batches = kwargs.get('staged_batches', 1)
 
         # generic loss setup - start
         controlled_losses = kwargs.get('controlled_losses', [])
         if controlled_losses is None:
             controlled_losses = []
         self.losses = {}
+        # epoch fraction seen by the in-graph loss weight schedules
+        self.training_progress = K.variable(0.)
+        self.last_training_progress = None
         for loss_name in self.loss_names:
 
             # get correct string if it exists
@@ -72,6 +110,8 @@ class BaseModel(metaclass=ABCMeta):
                 self.losses[loss_name] = Loss.from_control_string(control_string)
             else:
                 self.losses[loss_name] = Loss()
+            self.losses[loss_name].bind_schedule(self.training_progress)
+        self.schedules_end = max(loss.get_schedule_end() for loss in self.losses.values())
         self.opt_states = None
         self.optimizers = None
         self.update_loss_weights()
@@ -81,10 +121,34 @@ class BaseModel(metaclass=ABCMeta):
         if kwargs.get('metrics') is not None:
             desired_metrics = kwargs.get('metrics')
             self.metrics = {m: metrics.build_metric_by_name(m, experiment_id=self.experiment_id, **kwargs) for m in desired_metrics}
+            self.setup_metric_executor(kwargs.get('metric_workers', 0), kwargs.get('metric_timeouts'))
         else:
             self.metrics = None
         # generic metric setup - end
 
+    def setup_metric_executor(self, n_workers, timeouts=None):
+        """
+        Moves the process safe metrics to n_workers worker processes (none
+        if 0). timeouts are strings in format seconds, the default, or
+        metric_name:seconds.
+        """
+        if not n_workers:
+            return
+        default_timeout, metric_timeouts = None, {}
+        for timeout in timeouts or []:
+            if ':' in timeout:
+                m, seconds = timeout.rsplit(':', 1)
+                metric_timeouts[m] = float(seconds)
+            else:
+                default_timeout = float(timeout)
+        process_safe = {m: metric for m, metric in self.metrics.items() if metric.process_safe}
+        if not process_safe:
+            return
+        executor = ProcessMetricExecutor(n_workers,
+                                         preload=sorted(set(type(metric).__module__ for metric in process_safe.values())))
+        for m, metric in process_safe.items():
+            metric.use_executor(executor, timeout=metric_timeouts.get(m, default_timeout))
+
     def get_experiment_id(self):
         id = "{}_zdim{}".format(self.name, self.z_dims)
         for l, loss in self.losses.items():
@@ -116,7 +180,6 @@ class BaseModel(metaclass=ABCMeta):
         # Create output directories if not exist
         self.dataset = dataset
         self.batchsize = batchsize
-        self.processed_images = 0
         out_dir = os.path.join(self.output, self.experiment_id)
         if not os.path.isdir(out_dir):
             os.mkdir(out_dir)
@@ -133,26 +196,70 @@ class BaseModel(metaclass=ABCMeta):
         if not os.path.isdir(self.tmp_out_dir):
             os.mkdir(self.tmp_out_dir)
 
+        # only datasets that support it get the prefetching options
+        generator_options = {}
+        if self.prefetch_batches > 0 and 'prefetch' in inspect.signature(dataset.generator).parameters:
+            generator_options = {'prefetch': self.prefetch_batches,
+                                 'n_workers': self.prefetch_workers}
+
+        # staged batches: the loop bookkeeping only runs once per group of
+        # batches, each still trained on by its own calls of the trainers,
+        # which skip the Keras input checks
+        if self.staged_batches > 1:
+            for k, trainer in self.trainers.items():
+                if getattr(trainer, 'optimizer', None) is not None:
+                    use_callable_trainer(trainer)
+
+        # time every phase of the training steps if asked to
+        if self.profile_every > 0:
+            profiler = StepProfiler(summary_every=self.profile_every, trace_file=self.profile_trace)
+            for k, trainer in self.trainers.items():
+                trainer.train_on_batch = profiler.wrap('train:{}'.format(k), trainer.train_on_batch)
+            if getattr(self, 'fused_trainer', None) is not None:
+                self.fused_trainer.train_on_batch = profiler.wrap('train:fused_trainer',
+                                                                  self.fused_trainer.train_on_batch)
+        else:
+            profiler = NullProfiler()
+
+        # checkpoints of an older format only know the processed images
+        if self.resume_state is None and self.processed_images > 0:
+            self.last_epoch = self.processed_images // len(dataset)
+
         # Start training
         print('\n\n--- START TRAINING ---\n')
         for e in range(self.last_epoch, epochs):
             start_time = time.time()
             self.current_epoch = e + 1
-            for x_batch, y_batch, batch_index in dataset.generator(batchsize=self.batchsize):
+            batches = profiler.iterate('data', self.get_epoch_generator(dataset, generator_options))
+            if self.staged_batches > 1:
+                batches = stage_batches(batches, self.staged_batches)
+            for x_batch, y_batch, batch_index in batches:
 
                 # finally, train and report status
-                losses = self.train_on_batch(x_batch, y_batch=y_batch)
-                self.update_loss_history(losses)
-                self.processed_images += self.batchsize
+                with profiler.phase('train_on_batch'):
+                    if self.staged_batches > 1:
+                        n_steps = len(x_batch)
+                        losses = self.train_on_batches(x_batch, y_batch)
+                    else:
+                        n_steps = 1
+                        losses = self.train_on_batch(x_batch, y_batch=y_batch)
+                with profiler.phase('update_loss_history'):
+                    self.update_loss_history(losses)
+                n_images = self.batchsize * n_steps
+                self.processed_images += n_images
+                self.epoch_batches += n_steps
                 self.current_fract_epoch = self.processed_images / len(self.dataset)
 
-                print_current_progress(e, batch_index,
-                                       batch_size=self.batchsize,
-                                       dataset_length=len(self.dataset),
-                                       losses=self.losses,
-                                       elapsed_time=time.time() - start_time)
+                with profiler.phase('print_progress'):
+                    print_current_progress(e, batch_index,
+                                           batch_size=self.batchsize,
+                                           dataset_length=len(self.dataset),
+                                           losses=self.losses,
+                                           elapsed_time=time.time() - start_time)
 
                 # check for collapse scenario where G and D losses are equal
+                if self.staged_batches > 1:
+                    losses = {l: values[-1] for l, values in losses.items()}
                 did_collapse = self.did_collapse(losses)
                 if did_collapse:
                     message = "[{}] {}. Stopped at Epoch #{}".format(self.experiment_id, did_collapse, self.current_epoch)
@@ -165,21 +272,73 @@ class BaseModel(metaclass=ABCMeta):
 
                 if self.test_mode:
                     print('\nFinish testing: %s' % self.experiment_id)
+                    profiler.close()
                     return
 
+                with profiler.phase('update_loss_weights'):
+                    self.update_loss_weights()
+
                 # plot samples and losses and send notification if it's checkpoint time
-                if self.processed_images % self.checkpoint_every < (self.processed_images - self.batchsize) % self.checkpoint_every:
-                    self.save_model(self.wgt_out_dir, self.processed_images)
-                if self.processed_images % self.notify_every < (self.processed_images - self.batchsize) % self.notify_every:
-                    self.send_metrics_notification()
+                if self.processed_images % self.notify_every < (self.processed_images - n_images) % self.notify_every:
+                    with profiler.phase('send_metrics_notification'):
+                        self.send_metrics_notification()
+                if self.processed_images % self.checkpoint_every < (self.processed_images - n_images) % self.checkpoint_every:
+                    with profiler.phase('save_model'):
+                        self.save_model(self.wgt_out_dir, self.processed_images)
 
-                self.update_loss_weights()
+                profiler.end_step()
 
             elapsed_time = time.time() - start_time
             print('Took: {}s\n'.format(elapsed_time))
             self.did_train_over_an_epoch()
 
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+        profiler.close()
+
+    def get_epoch_generator(self, dataset, generator_options):
+        """
+        Returns the batch generator of the current epoch. When resuming from a
+        checkpoint taken mid-epoch, the epoch's permutation is rebuilt from its
+        saved random state and the batches already trained on are skipped.
+        """
+        state, self.resume_state = self.resume_state, None
+        if state is None or state['epoch_rng_state'] is None:
+            self.epoch_rng_state = np.random.get_state()
+            self.epoch_batches = 0
+            return dataset.generator(batchsize=self.batchsize, **generator_options)
+
+        np.random.set_state(state['epoch_rng_state'])
+        self.epoch_rng_state = state['epoch_rng_state']
+        self.epoch_batches = state['epoch_batches']
+        if 'start_batch' in inspect.signature(dataset.generator).parameters:
+            generator = dataset.generator(batchsize=self.batchsize, start_batch=self.epoch_batches,
+                                          **generator_options)
+        else:
+            generator = dataset.generator(batchsize=self.batchsize, **generator_options)
+            next(itertools.islice(generator, self.epoch_batches, self.epoch_batches), None)
+        np.random.set_state(state['rng_state'])
+        random.setstate(state['py_rng_state'])
+        print("[Resume] Continuing epoch {} from batch {}".format(self.current_epoch, self.epoch_batches))
+        return generator
+
+    def update_training_progress(self):
+        """
+        Feeds the epoch fraction to the in-graph schedules. Past the end of
+        every schedule the weights are constant and nothing is sent.
+        Returns whether the progress changed.
+        """
+        progress = min(self.current_fract_epoch, self.schedules_end)
+        if progress == self.last_training_progress:
+            return False
+        K.set_value(self.training_progress, progress)
+        self.last_training_progress = progress
+        return True
+
     def update_loss_weights(self):
+        # the host-side mirrors of the schedules only change with the progress
+        if not self.update_training_progress():
+            return
         weight_delta = 0.
         for l, loss in self.losses.items():
             new_loss, delta = loss.update_weight_based_on_time(self.current_fract_epoch)
@@ -191,35 +350,163 @@ class BaseModel(metaclass=ABCMeta):
             self.reset_optimizers()
             print("[TRAINING] Did reset optmizers.")
 
+    def build_optimizer_snapshots(self):
+        """
+        Creates a shadow variable for every optimizer slot and the backend
+        functions copying the slots to their shadows and back, so that saving
+        and restoring the optimizers never moves their state to the host
+        """
+        self.opt_states = {}
+        save_updates, restore_updates = [], []
+        for k, opt in self.optimizers.items():
+            shadows = [K.zeros(K.int_shape(w), dtype=K.dtype(w)) for w in opt.weights]
+            save_updates += [K.update(s, w) for s, w in zip(shadows, opt.weights)]
+            restore_updates += [K.update(w, s) for s, w in zip(shadows, opt.weights)]
+            self.opt_states[k] = shadows
+        self.save_optimizer_states = K.function([], [], updates=save_updates)
+        self.restore_optimizer_states = K.function([], [], updates=restore_updates)
+
     def reset_optimizers(self):
         if self.opt_states is None:
-            if self.optimizers is not None:
-                self.opt_states = {k: opt.get_weights() for k, opt in self.optimizers.items()}
+            # optimizer slots only exist once the models trained once
+            if self.optimizers is not None and all(opt.weights for opt in self.optimizers.values()):
+                self.build_optimizer_snapshots()
+                self.save_optimizer_states([])
             return
-        for k, opt in self.optimizers.items():
-            opt.set_weights(self.opt_states[k])
+        self.restore_optimizer_states([])
 
     def update_loss_history(self, new_losses):
         for l, loss in self.losses.items():
-            loss.update_history(new_losses[l] / self.batchsize)
+            if np.ndim(new_losses[l]) > 0:
+                loss.extend_history(np.asarray(new_losses[l]) / self.batchsize)
+            else:
+                loss.update_history(new_losses[l] / self.batchsize)
 
     def did_collapse(self, losses):
         return False
 
     def save_model(self, out_dir, epoch):
-        folder = os.path.join(out_dir, 'epoch_%05d' % epoch)
-        if not os.path.isdir(folder):
-            os.mkdir(folder)
-
-        for k, v in self.trainers.items():
-            filename = os.path.join(folder, '%s.hdf5' % (k))
-            v.save_weights(filename)
+        """
+        Snapshots the weights and training state, which are written to
+        out_dir/epoch_<epoch> in the background
+        """
+        if self.checkpoint_writer is None or self.checkpoint_writer.out_dir != out_dir:
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
+            self.checkpoint_writer = CheckpointWriter(out_dir,
+                                                      keep_last=self.checkpoint_keep_last,
+                                                      keep_every=self.checkpoint_keep_every,
+                                                      keep_best=self.checkpoint_keep_best is not None,
+                                                      best_mode=self.checkpoint_best_mode)
+
+        training_state = self.get_training_state()
+        self.checkpoint_writer.save('epoch_%05d' % epoch, self.trainers, training_state,
+                                    metric_value=self.get_checkpoint_metric_value())
+
+    def get_checkpoint_metric_value(self):
+        """
+        Value used to keep the best checkpoint: the result of the latest
+        computation of a metric or the recent mean of a loss, named by
+        checkpoint_keep_best. A metric still being computed is waited for by
+        the checkpoint writer, not here.
+        """
+        if self.checkpoint_keep_best is None:
+            return None
+        name = self.checkpoint_keep_best
+        if self.metrics is not None and name in self.metrics:
+            metric = self.metrics[name]
+            return metric.get_latest_value() if hasattr(metric, 'get_latest_value') else None
+        if name in self.losses:
+            return self.losses[name].get_mean_of_latest()
+        raise KeyError("Unknown metric or loss {} to select the best checkpoint".format(name))
+
+    def get_trained_optimizers(self):
+        """
+        Returns the optimizers of the compiled trainers, each one once, by
+        the name of the first trainer using it
+        """
+        optimizers, seen = {}, set()
+        for k in sorted(self.trainers):
+            opt = getattr(self.trainers[k], 'optimizer', None)
+            if opt is not None and id(opt) not in seen:
+                seen.add(id(opt))
+                optimizers[k] = opt
+        return optimizers
+
+    def get_training_state(self):
+        """
+        Everything besides the network weights needed to continue training
+        exactly where it stopped
+        """
+        opt_weights = {k: opt.get_weights() for k, opt in self.get_trained_optimizers().items()
+                       if opt.weights}
+        if self.metrics is not None:
+            metric_states = {m: metric.get_state() for m, metric in self.metrics.items()}
+        else:
+            metric_states = None
+        if self.opt_states is not None:
+            opt_states = {k: K.batch_get_value(shadows) for k, shadows in self.opt_states.items()}
+        else:
+            opt_states = None
+        return {'epoch': self.current_epoch - 1,
+                'epoch_batches': self.epoch_batches,
+                'processed_images': self.processed_images,
+                'current_fract_epoch': self.current_fract_epoch,
+                'epoch_rng_state': self.epoch_rng_state,
+                'rng_state': np.random.get_state(),
+                'py_rng_state': random.getstate(),
+                'losses': {l: loss.get_state() for l, loss in self.losses.items()},
+                'metrics': metric_states,
+                'optimizers': opt_weights,
+                'opt_states': opt_states}
+
+    def set_training_state(self, state):
+        self.last_epoch = state['epoch']
+        self.current_epoch = state['epoch'] + 1
+        self.processed_images = state['processed_images']
+        self.current_fract_epoch = state['current_fract_epoch']
+        for l, loss_state in state['losses'].items():
+            self.losses[l].set_state(loss_state)
+        self.update_training_progress()
+        if self.metrics is not None and state['metrics'] is not None:
+            for m, metric_state in state['metrics'].items():
+                if m in self.metrics:
+                    self.metrics[m].set_state(metric_state)
+        if state['optimizers'] is not None:
+            for k, opt in self.get_trained_optimizers().items():
+                if k not in state['optimizers']:
+                    continue
+                # the optimizer's slots only exist once its training function
+                # is built, unless e.g. a fused trainer already created them
+                if not opt.weights:
+                    self.trainers[k]._make_train_function()
+                opt.set_weights(state['optimizers'][k])
+        if state['opt_states'] is not None and self.optimizers is not None:
+            if self.opt_states is None:
+                self.build_optimizer_snapshots()
+            K.batch_set_value([(shadow, value)
+                               for k, shadows in self.opt_states.items()
+                               for shadow, value in zip(shadows, state['opt_states'][k])])
+        self.resume_state = state
 
     def store_to_save(self, name):
         self.trainers[name] = getattr(self, name)
 
-    def load_model(self, folder):
-        for k, v in self.trainers.items():
+    def load_weights(self, folder, names=None):
+        """
+        Loads the weights of the given trainers or submodels (every trainer by
+        default) from a checkpoint folder. With the deduplicated format only
+        the variables of the requested models are read, e.g.
+        load_weights(folder, ['f_Gx']) to sample from a checkpoint.
+        """
+        if names is None:
+            names = list(self.trainers.keys())
+        if has_checkpoint_weights(folder):
+            load_checkpoint_weights(folder, {k: getattr(self, k) for k in names})
+            return
+
+        # older checkpoints hold one hdf5 file per trainer
+        for k in names:
             try:
                 filename = os.path.join(folder, "{}.hdf5".format(k))
                 getattr(self, k).load_weights(filename)
@@ -230,13 +517,31 @@ class BaseModel(metaclass=ABCMeta):
                 print(e)
                 print("Couldn't load {}. Starting from scratch".format(filename))
 
-        # load epoch number
-        epoch = int(folder.split('_')[-1].replace('/', ''))
-        self.last_epoch = epoch
+    def load_model(self, folder):
+        self.load_weights(folder)
+
+        state_filename = os.path.join(folder, 'training_state.pkl')
+        if os.path.exists(state_filename):
+            with open(state_filename, 'rb') as f:
+                self.set_training_state(pickle.load(f))
+        else:
+            # older checkpoints: the folder name holds the processed images,
+            # converted to an epoch once the dataset is known
+            self.processed_images = int(os.path.normpath(folder).split('_')[-1])
+            print("No training state found in {}. Only the weights were restored".format(folder))
 
     def did_train_over_an_epoch(self):
         pass
 
+    def train_on_batches(self, x_batches, y_batches):
+        """
+        Trains on each of the staged batches in turn. Returns every loss as
+        an array with one value per batch.
+        """
+        steps = [self.train_on_batch(x_batch, y_batch=y_batch)
+                 for x_batch, y_batch in zip(x_batches, y_batches)]
+        return {l: np.array([step[l] for step in steps]) for l in steps[0]}
+
     @abstractmethod
     def train_on_batch(self, x_batch, y_batch=None, compute_grad_norms=False):
         '''
@@ -290,19 +595,23 @@ class BaseModel(metaclass=ABCMeta):
                 iters.append(subiters[0])
                 names.append(subnames)
             else:
-                metrics.append(self.losses[l].history)
-                iters.append(1)
+                # bucket means keep the number of plotted points bounded
+                _, means, _, bucket = self.losses[l].history.downsample(self.max_plot_points)
+                metrics.append(means)
+                iters.append(bucket)
                 names.append(l)
         return metrics, iters, names, ['lines'] * len(metrics)
 
     def get_loss_weight_metrics_for_plot(self):
         metrics, names = [], []
+        bucket = 1
         contrast_increment = 0  # increment to help loss weight visualization
         for l, loss in self.losses.items():
-            metrics.append(np.array(loss.weight_history) + contrast_increment)
+            _, means, _, bucket = loss.weight_history.downsample(self.max_plot_points)
+            metrics.append(means + contrast_increment)
             names.append(l)
             contrast_increment += 0.005
-        return [metrics], [1], [names], ['lines']
+        return [metrics], [bucket], [names], ['lines']
 
     def get_metrics_for_plot(self):
         metrics, iters, names, types = [], [], [], []
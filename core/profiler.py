@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import threading
+import functools
+import collections
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StepProfiler(object):
+    """
+    Times the phases of every training step, plus the whole step as the time
+    between end_step calls. The latest window durations of each phase are
+    kept to report rolling percentiles in a summary table, printed every
+    summary_every steps; every timed phase is also recorded, up to
+    max_events, as a Chrome trace (chrome://tracing, Perfetto) written to
+    trace_file on each summary and on close().
+    """
+
+    def __init__(self, summary_every=100, window=1000, trace_file=None, max_events=1000000):
+        self.summary_every = summary_every
+        self.trace_file = trace_file
+        self.max_events = max_events
+        self.durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.totals = collections.defaultdict(float)
+        self.events = []
+        self.n_steps = 0
+        self.origin = time.perf_counter()
+        self.last_step_end = self.origin
+
+    def record(self, name, start, duration):
+        self.durations[name].append(duration)
+        self.totals[name] += duration
+        if self.trace_file is not None and len(self.events) < self.max_events:
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(),
+                                'tid': threading.get_ident(),
+                                'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6})
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def wrap(self, name, func):
+        """
+        Returns func timed as phase name
+        """
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+    def iterate(self, name, iterable):
+        """
+        Yields the items of iterable, timing how long each one takes to arrive
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, start, time.perf_counter() - start)
+            yield item
+
+    def end_step(self):
+        now = time.perf_counter()
+        self.record('step', self.last_step_end, now - self.last_step_end)
+        self.last_step_end = now
+        self.n_steps += 1
+        if self.summary_every and self.n_steps % self.summary_every == 0:
+            print('\n' + self.summary())
+            self.export_chrome_trace()
+
+    def summary(self):
+        step_total = self.totals.get('step')
+        lines = ["[Profiler] Step {} (last {} samples per phase, ms)".format(
+                     self.n_steps, max(len(d) for d in self.durations.values())),
+                 "{:<28}{:>9}{:>9}{:>9}{:>9}{:>8}".format('phase', 'mean', 'p50', 'p90', 'p99', '%step')]
+        for name in sorted(self.durations, key=lambda n: -self.totals[n]):
+            d = np.array(self.durations[name]) * 1e3
+            p50, p90, p99 = np.percentile(d, [50, 90, 99])
+            # share of the whole run's step time, whatever the phase frequency
+            share = ''
+            if step_total and name != 'step':
+                share = '{:.1f}'.format(100. * self.totals[name] / step_total)
+            lines.append("{:<28}{:>9.2f}{:>9.2f}{:>9.2f}{:>9.2f}{:>8}".format(name, d.mean(), p50, p90, p99, share))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self):
+        if self.trace_file is None:
+            return
+        tmp_file = self.trace_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp_file, self.trace_file)
+
+    def close(self):
+        self.export_chrome_trace()
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler(object):
+    """
+    Stand-in used when profiling is disabled, doing as little as possible
+    """
+    _context = _NullContext()
+
+    def phase(self, name):
+        return self._context
+
+    def wrap(self, name, func):
+        return func
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def end_step(self):
+        pass
+
+    def close(self):
+        pass
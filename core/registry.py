@@ -0,0 +1,69 @@
+import os
+import ast
+import importlib
+import collections.abc
+
+
+def _literal_string(node):
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return None
+    return value if isinstance(value, str) else None
+
+
+def find_named_classes(pkg_dir):
+    """
+    Returns {name: (module, class name)} for every class of the modules of
+    pkg_dir that sets a literal name class attribute, reading the sources
+    without importing them
+    """
+    named_classes = {}
+    for filename in sorted(os.listdir(pkg_dir)):
+        module, ext = os.path.splitext(filename)
+        if ext != '.py' or module == '__init__':
+            continue
+        with open(os.path.join(pkg_dir, filename), 'rb') as f:
+            tree = ast.parse(f.read(), filename=filename)
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for statement in node.body:
+                if (isinstance(statement, ast.Assign)
+                        and any(isinstance(t, ast.Name) and t.id == 'name' for t in statement.targets)):
+                    name = _literal_string(statement.value)
+                    if name is not None:
+                        named_classes[name] = (module, node.name)
+    return named_classes
+
+
+class LazyRegistry(collections.abc.Mapping):
+    """
+    Read-only mapping of name to class over the modules of a package. Names
+    are listed without importing anything; a module is imported the first
+    time one of its classes is looked up.
+    """
+
+    def __init__(self, package, pkg_dir):
+        self.package = package
+        self.pkg_dir = pkg_dir
+        self._classes = None
+
+    @property
+    def classes(self):
+        if self._classes is None:
+            self._classes = find_named_classes(self.pkg_dir)
+        return self._classes
+
+    def __getitem__(self, name):
+        module, class_name = self.classes[name]
+        return getattr(importlib.import_module('.' + module, self.package), class_name)
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __contains__(self, name):
+        return name in self.classes
@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import hashlib
+import inspect
+
+import numpy as np
+
+curdir = os.path.abspath(os.path.dirname(__file__))
+cachedir = os.path.join(curdir, 'files', 'cache')
+
+# bump whenever the on-disk layout of the cache changes
+CACHE_VERSION = 1
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+
+def get_cache_key(name, load_fn, source_files, options):
+    """
+    Hashes everything the cached arrays depend on: the dataset name, the
+    preprocessing options, the loader's source code and the size and
+    modification time of the raw files it reads
+    """
+    with open(inspect.getsourcefile(load_fn), 'rb') as f:
+        loader_hash = hashlib.sha1(f.read()).hexdigest()
+    description = {
+        'version': CACHE_VERSION,
+        'name': name,
+        'loader': [load_fn.__name__, loader_hash],
+        'options': sorted(options.items()),
+        'sources': [_file_signature(p) for p in sorted(source_files)],
+    }
+    serialized = json.dumps(description, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(serialized).hexdigest()
+
+
+def _read_cache(folder):
+    with open(os.path.join(folder, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    data = []
+    for entry in manifest['entries']:
+        if entry['type'] == 'array':
+            # copy-on-write keeps in-place edits of the arrays in memory only
+            data.append(np.load(os.path.join(folder, entry['file']), mmap_mode='c'))
+        else:
+            data.append(entry['value'])
+    return tuple(data)
+
+
+def _remove_stale_caches(name, options):
+    if not os.path.isdir(cachedir):
+        return
+    for entry in os.listdir(cachedir):
+        folder = os.path.join(cachedir, entry)
+        try:
+            with open(os.path.join(folder, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if manifest.get('name') == name and manifest.get('options') == options:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def _write_cache(folder, data, name, options):
+    tmp_folder = "{}.tmp{}".format(folder, os.getpid())
+    if os.path.isdir(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    entries = []
+    for i, d in enumerate(data):
+        if isinstance(d, np.ndarray):
+            filename = 'arr_{}.npy'.format(i)
+            np.save(os.path.join(tmp_folder, filename), d)
+            entries.append({'type': 'array', 'file': filename})
+        else:
+            entries.append({'type': 'value', 'value': d})
+    with open(os.path.join(tmp_folder, 'manifest.json'), 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'name': name, 'options': options,
+                   'entries': entries}, f)
+
+    # another process may have finished the same cache in the meantime
+    try:
+        os.rename(tmp_folder, folder)
+    except OSError:
+        shutil.rmtree(tmp_folder)
+
+
+def cached_load(name, load_fn, source_files_fn, **options):
+    """
+    Returns load_fn(**options), reusing a memory mapped copy of its output
+    stored in the cache folder when one exists for the same name, options,
+    loader code and raw files. Outdated entries with the same name and
+    options are removed when a new one is written.
+
+    name: dataset name, used as prefix of the cache folder
+    load_fn: loader returning a tuple of numpy arrays and json-able values
+    source_files_fn: callable returning the paths of the raw files read by
+                     load_fn, called after load_fn if any of them is missing
+    """
+    source_files = source_files_fn(**options)
+    if all(os.path.exists(p) for p in source_files):
+        key = get_cache_key(name, load_fn, source_files, options)
+        folder = os.path.join(cachedir, "{}_{}".format(name, key[:16]))
+        if os.path.isdir(folder):
+            try:
+                return _read_cache(folder)
+            except (OSError, ValueError, KeyError) as e:
+                print("[Cache] Ignoring corrupted cache {}: {}".format(folder, repr(e)))
+                shutil.rmtree(folder, ignore_errors=True)
+
+    # the loader takes care of downloading the raw files if needed
+    data = load_fn(**options)
+
+    key = get_cache_key(name, load_fn, source_files_fn(**options), options)
+    folder = os.path.join(cachedir, "{}_{}".format(name, key[:16]))
+    _remove_stale_caches(name, options)
+    _write_cache(folder, data, name, options)
+    print("[Cache] Stored {} in {}".format(name, folder))
+    return _read_cache(folder)
@@ -1,20 +1,15 @@
 import os
 import requests
-import glob
 
-import numpy as np
-import scipy as sp
-import h5py
+from datasets.ingest import ingest_images
 
 url = "https://www.dropbox.com/sh/8oqt9vytwxb3s4r/AADIKlz8PR9zr6Y20qbkunrba/Img/img_align_celeba.zip?dl=1&pv=1"
 curdir = os.path.abspath(os.path.dirname(__file__))
 outdir = os.path.join(curdir, 'files')
 h5_filepath = os.path.join(outdir, 'celeba.h5')
 out_zipfile = os.path.join(outdir, 'celeba.zip')
-out_unzipped_folder = os.path.join(outdir, 'unzipped_celeba')
 
 CHUNK_SIZE = 32768
-DISK_BUFFER_SIZE = 30000
 IMG_SIZE = 64
 
 
@@ -35,41 +30,17 @@ def download_celeba():
         print('Done!')
 
 
-def preprocess_image(x, crop_size=IMG_SIZE):
-    smallest_size = np.min((x.shape[0], x.shape[1]))
-    crop_y = (x.shape[0] - smallest_size) // 2
-    crop_x = (x.shape[1] - smallest_size) // 2
-    x = x[crop_y:(x.shape[0] - crop_y), crop_x:(x.shape[1] - crop_x), :]
-    x = x.astype(np.float32)
-    return sp.misc.imresize(x, (crop_size, crop_size)) / 255.
-
-
 def load_data():
     """
-    Load and return dataset as tuple (data, label, label_strings)
+    Load and return the path to the hdf5 file holding the dataset as uint8
     """
 
     if not os.path.exists(out_zipfile):
         download_celeba()
 
-    if not os.path.exists(out_unzipped_folder):
-        import zipfile
-        with zipfile.ZipFile(out_zipfile, 'r') as zip_ref:
-            print("Unzipping contents... ", end='')
-            zip_ref.extractall(out_unzipped_folder)
-            print("Done!")
-
+    # images are decoded in parallel straight from the zip file
     if not os.path.exists(h5_filepath):
-        image_paths = glob.glob("{}/img_align_celeba/*.jpg".format(out_unzipped_folder))
-        data_lenght = len(image_paths)
-        count = 0
-        with h5py.File(h5_filepath, mode='w') as hdf5_file:
-            hdf5_file.create_dataset("data", (data_lenght, IMG_SIZE, IMG_SIZE, 3), np.float32)
-            for img_path in image_paths:
-                img = preprocess_image(sp.misc.imread(img_path))
-                hdf5_file['data'][count, ...] = img
-                count += 1
-                print('Preprocessed', count, 'images', end='\r')
+        ingest_images(out_zipfile, h5_filepath, img_size=IMG_SIZE)
     return h5_filepath
 
 if __name__ == '__main__':
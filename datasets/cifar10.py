@@ -1,12 +1,25 @@
+import os
+
 import keras
 import numpy as np
 
+keras_folder = os.path.join(os.path.expanduser('~'), '.keras', 'datasets', 'cifar-10-batches-py')
+
+
+def source_files(**kwargs):
+    """
+    Raw files read by load_data, used to invalidate the dataset cache
+    """
+    batches = ['data_batch_{}'.format(i) for i in range(1, 6)] + ['test_batch']
+    return [os.path.join(keras_folder, b) for b in batches]
+
 
-def load_data():
+def load_data(as_uint8=False):
     (x_train, y_train), (x_test, y_test) = keras.datasets.cifar10.load_data()
 
-    x_train = x_train.astype('float32') / 255.
-    x_test = x_test.astype('float32') / 255.
+    if not as_uint8:
+        x_train = x_train.astype('float32') / 255.
+        x_test = x_test.astype('float32') / 255.
     y_train = keras.utils.to_categorical(y_train)
     y_train = y_train.astype('float32')
     y_test = np.squeeze(y_test)
@@ -1,7 +1,6 @@
 import os
 import sys
 import re
-import zipfile
 
 import numpy as np
 import h5py
@@ -9,6 +8,8 @@ import h5py
 import requests
 from PIL import Image
 
+from datasets.ingest import ingest_images
+
 google_drive_prefix = "https://docs.google.com/uc?export=download"
 image_url = 'https://drive.google.com/open?id=0B7EVK8r0v71pZjFTYXZWM3FlRnM'
 attr_url = 'https://drive.google.com/open?id=0B7EVK8r0v71pblRyaVFSWGxPY0U'
@@ -62,6 +63,9 @@ def download_from_google_drive(url, dest):
     print('Downloading:', url)
     save_response_content(response, dest)
 
+def resize_and_crop(image):
+    return image.resize((64, 78), Image.LANCZOS).crop((0, 7, 64, 64 + 7))
+
 def main():
     # Download image ZIP
     if os.path.exists(image_file):
@@ -91,31 +95,16 @@ def main():
             label = np.maximum(0, label).astype(np.uint8)
             labels[i] = label
 
-    ## Parse images
-    with zipfile.ZipFile(image_file, 'r', zipfile.ZIP_DEFLATED) as zf:
-        image_files = [f for f in zf.namelist()]
-        image_files = sorted(image_files)
-        image_files = list(filter(lambda f: f.endswith('.jpg'), image_files))
-
-        num_images = len(image_files)
-        print('%d images' % (num_images))
-
-        image_data = np.ndarray((num_images, 64, 64, 3), dtype='uint8')
-        for i, f in enumerate(image_files):
-            image = Image.open(zf.open(f, 'r')).resize((64, 78), Image.ANTIALIAS).crop((0, 7, 64, 64 + 7))
-            image = np.asarray(image, dtype='uint8')
-            image_data[i] = image
-            print('%d / %d' % (i + 1, num_images), end='\r', flush=True)
-
-    # Create HDF5 file
-    h5 = h5py.File(outfile, 'w')
-    string_dt = h5py.special_dtype(vlen=str)
-    dset = h5.create_dataset('images', data=image_data, dtype='uint8')
-    dset = h5.create_dataset('label_names', data=label_names, dtype=string_dt)
-    dset = h5.create_dataset('labels', data=labels, dtype='uint8')
-
-    h5.flush()
-    h5.close()
+    # Parse images in parallel and store them in the HDF5 file
+    image_files = ingest_images(image_file, outfile, preprocess=resize_and_crop,
+                                dataset_name='images', mode='w')
+    print('%d images' % (len(image_files)))
+
+    # Append labels to the HDF5 file
+    with h5py.File(outfile, 'a') as h5:
+        string_dt = h5py.special_dtype(vlen=str)
+        h5.create_dataset('label_names', data=label_names, dtype=string_dt)
+        h5.create_dataset('labels', data=labels, dtype='uint8')
 
 if __name__ == '__main__':
     main()
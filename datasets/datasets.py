@@ -1,8 +1,5 @@
 import h5py
 import numpy as np
-import itertools
-import glob
-import threading
 import os
 
 from datasets import svhn
@@ -11,10 +8,23 @@ from datasets import moving_mnist
 from datasets import lsun
 from datasets import cifar10
 from datasets import celeba
+from datasets import shards
+from datasets.prefetch import iterate_batches, BatchPrefetcher
+from datasets.cache import cached_load
 
 import sklearn as sk
 
 
+def to_float_images(x):
+    """
+    Scales images stored as uint8 to float32 in [0, 1]. Any other dtype is
+    assumed to be already normalized and is returned untouched.
+    """
+    if x.dtype == np.uint8:
+        return x.astype('float32') / 255.
+    return x
+
+
 class Dataset(object):
 
     def __init__(self, name):
@@ -32,14 +42,14 @@ class Dataset(object):
     def get_random_fixed_batch(self, n=32):
         np.random.seed(14)
         perm = np.random.permutation(len(self.images))
-        x_data = self.images[perm[:n]]
+        x_data = self.get_images(perm[:n])
         y_data = np.argmax(self.attrs[perm[:n]], axis=1)
         np.random.seed()
         return x_data, y_data
 
     def get_test_set(self):
         if hasattr(self, 'x_test') and hasattr(self, 'y_test'):
-            return self.x_test, self.y_test
+            return to_float_images(self.x_test), self.y_test
         else:
             raise KeyError("This dataset does not have a test set")
 
@@ -48,24 +58,48 @@ class Dataset(object):
             np.random.seed(14)
             perm = np.random.permutation(len(self.x_test))
             np.random.seed()
-            return self.x_test[perm[:n]], self.y_test[perm[:n]]
+            return to_float_images(self.x_test[perm[:n]]), self.y_test[perm[:n]]
         else:
             raise KeyError("This dataset does not have a test set")
 
     def has_test_set(self):
         return hasattr(self, 'x_test')
 
-    def generator(self, batchsize):
+    def get_epoch_batches(self, batchsize):
+        """
+        Returns a list of (indices, cursor) for every full batch of a
+        freshly permuted epoch
+        """
         general_cursor = 0
-        perm = np.random.permutation(len(self.images))
         n_data = len(self.images)
+        perm = np.random.permutation(n_data)
+        batches = []
         for b in range(0, n_data, batchsize):
             if batchsize > n_data - b:
                 continue
             general_cursor += batchsize
-            indx = perm[b:b + batchsize]
-            x_data, y_data = self.images[indx], np.zeros((batchsize,), dtype=np.uint8)
-            yield x_data, y_data, general_cursor
+            batches.append((perm[b:b + batchsize], general_cursor))
+        return batches
+
+    def get_images(self, indx):
+        """
+        Returns the float32 images at indx, scaling them on the fly if the
+        dataset keeps them as uint8
+        """
+        return to_float_images(self.images[indx])
+
+    def make_batch(self, indx):
+        return self.get_images(indx), np.zeros((len(indx),), dtype=np.uint8)
+
+    def generator(self, batchsize, prefetch=0, n_workers=1, start_batch=0):
+        """
+        Yields (x_data, y_data, cursor) tuples over one epoch. If prefetch > 0,
+        batches are assembled ahead of time by n_workers background threads
+        into queues holding up to prefetch ready batches. start_batch skips the
+        first batches of the epoch without assembling them, to resume it.
+        """
+        return iterate_batches(self.make_batch, self.get_epoch_batches(batchsize)[start_batch:],
+                               prefetch=prefetch, n_workers=n_workers)
 
 
 class ConditionalDataset(Dataset):
@@ -82,19 +116,10 @@ class ConditionalDataset(Dataset):
                                                                    stratify=y_categorical,
                                                                    test_size=n,
                                                                    random_state=14)
-        return x_data, y_data
+        return to_float_images(x_data), y_data
 
-    def generator(self, batchsize):
-        general_cursor = 0
-        n_data = len(self.images)
-        perm = np.random.permutation(n_data)
-        for b in range(0, n_data, batchsize):
-            if batchsize > n_data - b:
-                continue
-            general_cursor += batchsize
-            indx = perm[b:b + batchsize]
-            x_data, y_data = self.images[indx], self.attrs[indx]
-            yield x_data, y_data, general_cursor
+    def make_batch(self, indx):
+        return self.get_images(indx), self.attrs[indx]
 
 
 class CrossDomainDatasets(object):
@@ -104,18 +129,20 @@ class CrossDomainDatasets(object):
         assert len(anchor_dataset.attr_names) == len(mirror_dataset.attr_names)
         self.anchor = anchor_dataset
         self.mirror = mirror_dataset
-        self.counter = itertools.count(0)
-
-        # speedup future lookups by prepreparing slices
-        labels = self.anchor.attrs
-        ncols = labels.shape[1]
-        dtype = labels.dtype.descr * ncols
-        struct = labels.view(dtype)
-        uniq = np.unique(struct)
-        self.uniq_y = uniq.view(labels.dtype).reshape(-1, ncols)
-        self.slices_p = {tuple(m): np.where((self.mirror.attrs == tuple(m)).all(axis=1))[0] for m in self.uniq_y}
-        self.slices_n = {tuple(m): np.where(~(self.mirror.attrs == tuple(m)).all(axis=1))[0] for m in self.uniq_y}
-        self.shuffle_p_n_samples()
+
+        # map every label vector of both domains to an integer class id
+        labels = np.concatenate((self.anchor.attrs, self.mirror.attrs))
+        self.uniq_y, class_ids = np.unique(labels, axis=0, return_inverse=True)
+        class_ids = class_ids.reshape(-1)
+        self.anchor_class = class_ids[:len(self.anchor)]
+        mirror_class = class_ids[len(self.anchor):]
+
+        # mirror indices sorted by class, each class being a contiguous block
+        # starting at class_start and spanning class_count rows
+        n_classes = len(self.uniq_y)
+        self.mirror_by_class = np.argsort(mirror_class, kind='mergesort')
+        self.class_count = np.bincount(mirror_class, minlength=n_classes)
+        self.class_start = np.concatenate(([0], np.cumsum(self.class_count)[:-1]))
 
         # the mirror permutation allows us to keep the model API the same
         # while providing good sampling across both datasets
@@ -123,43 +150,61 @@ class CrossDomainDatasets(object):
         self.current_m_index = 0
 
     def get_unlalabeled_pairs(self, idx, b_idx=None):
-        a_x = self.anchor.images[idx]
+        a_x = self.anchor.get_images(idx)
         if b_idx is None:
             b_idx = self.get_perm_mirror_indices(len(idx))
-        b_x = self.mirror.images[b_idx]
+        b_x = self.mirror.get_images(b_idx)
 
         return (a_x, b_x), (idx, b_idx)
 
-    def get_triplets(self, idx):
-        a_x, a_y = self.anchor.images[idx], self.anchor.attrs[idx]
-        p_idx = [self.slices_p[tuple(y)][self.slices_p_perm[tuple(y)][next(self.counter) % len(self.slices_p_perm[tuple(y)])]] for y in a_y]
-        n_idx = [self.slices_n[tuple(y)][self.slices_n_perm[tuple(y)][next(self.counter) % len(self.slices_n_perm[tuple(y)])]] for y in a_y]
-        p_x, p_y = self.mirror.images[p_idx], self.mirror.attrs[p_idx]
-        n_x, n_y = self.mirror.images[n_idx], self.mirror.attrs[n_idx]
+    def sample_positive_indices(self, idx):
+        """
+        Draws, for every anchor in idx, a random mirror index with the same label
+        """
+        c = self.anchor_class[idx]
+        count = self.class_count[c]
+        if np.any(count == 0):
+            raise ValueError("Some anchor labels do not exist in the mirror dataset")
+        offset = (np.random.random(len(c)) * count).astype(np.int64)
+        return self.mirror_by_class[self.class_start[c] + offset]
+
+    def sample_negative_indices(self, idx):
+        """
+        Draws, for every anchor in idx, a random mirror index with a different
+        label by sampling over the sorted mirror indices minus the anchor's block
+        """
+        c = self.anchor_class[idx]
+        count = self.class_count[c]
+        n_others = len(self.mirror) - count
+        if np.any(n_others == 0):
+            raise ValueError("Some anchor labels have no negatives in the mirror dataset")
+        pos = (np.random.random(len(c)) * n_others).astype(np.int64)
+        pos += (pos >= self.class_start[c]) * count
+        return self.mirror_by_class[pos]
 
-        if next(self.counter) > 2 * len(self.mirror):
-            self.shuffle_p_n_samples()
+    def get_triplets(self, idx):
+        a_x, a_y = self.anchor.get_images(idx), self.anchor.attrs[idx]
+        p_idx = self.sample_positive_indices(idx)
+        n_idx = self.sample_negative_indices(idx)
+        p_x, p_y = self.mirror.get_images(p_idx), self.mirror.attrs[p_idx]
+        n_x, n_y = self.mirror.get_images(n_idx), self.mirror.attrs[n_idx]
 
         return (a_x, p_x, n_x), (a_y, p_y, n_y)
 
     def get_positive_pairs(self, idx):
-        a_x, a_y = self.anchor.images[idx], self.anchor.attrs[idx]
-        p_idx = [self.slices_p[tuple(y)][self.slices_p_perm[tuple(y)][next(self.counter) % len(self.slices_p_perm[tuple(y)])]] for y in a_y]
-        p_x, p_y = self.mirror.images[p_idx], self.mirror.attrs[p_idx]
+        a_x, a_y = self.anchor.get_images(idx), self.anchor.attrs[idx]
+        p_idx = self.sample_positive_indices(idx)
+        p_x, p_y = self.mirror.get_images(p_idx), self.mirror.attrs[p_idx]
 
         return (a_x, p_x), (a_y, p_y)
 
     def get_negative_pairs(self, idx):
-        a_x, a_y = self.anchor.images[idx], self.anchor.attrs[idx]
-        n_idx = [self.slices_n[tuple(y)][self.slices_n_perm[tuple(y)][next(self.counter) % len(self.slices_n_perm[tuple(y)])]] for y in a_y]
-        n_x, n_y = self.mirror.images[n_idx], self.mirror.attrs[n_idx]
+        a_x, a_y = self.anchor.get_images(idx), self.anchor.attrs[idx]
+        n_idx = self.sample_negative_indices(idx)
+        n_x, n_y = self.mirror.get_images(n_idx), self.mirror.attrs[n_idx]
 
         return (a_x, n_x), (a_y, n_y)
 
-    def shuffle_p_n_samples(self):
-        self.slices_p_perm = {tuple(y): np.random.permutation(np.arange(self.slices_p[tuple(y)].shape[0])) for y in self.uniq_y}
-        self.slices_n_perm = {tuple(y): np.random.permutation(np.arange(self.slices_n[tuple(y)].shape[0])) for y in self.uniq_y}
-
     def get_perm_mirror_indices(self, bsize):
         size = min(bsize, len(self.mirror) - self.current_m_index)
         idx = self.mirror_permutation[self.current_m_index:self.current_m_index + size]
@@ -170,9 +215,7 @@ class CrossDomainDatasets(object):
         if size < bsize:
             remaining_size = bsize - size
             self.mirror_permutation = np.random.permutation(len(self.mirror))
-            remaining_idx = self.mirror_permutation[0:remaining_size]
-            if remaining_idx:
-                idx.append(remaining_idx)
+            idx = np.concatenate((idx, self.mirror_permutation[0:remaining_size]))
             self.current_m_index = remaining_size
 
         return idx
@@ -198,9 +241,31 @@ class TimeCorelatedDataset(Dataset):
 
     def __init__(self, name, x_data, input_n_frames=4):
         self.name = name
-        self.data = x_data
+        self.data = np.ascontiguousarray(x_data)
         self.input_n_frames = input_n_frames
 
+        # (video, start) index space: every start leaving room for the input
+        # and the ground truth windows, addressed as video * n_frames + start
+        self.n_frames = self.data.shape[1]
+        self.n_starts = self.n_frames - 2 * self.input_n_frames
+        self.windows = self._build_window_view()
+
+    def _build_window_view(self):
+        """
+        Returns a zero-copy view of shape (videos * frames - input_n_frames + 1,
+        H, W, input_n_frames, C) where row i holds the input_n_frames frames
+        starting at the i-th frame of the flattened videos, already in the
+        frames-over-channels layout
+        """
+        n_videos, n_frames, h, w, c = self.data.shape
+        _, sf, sh, sw, sc = self.data.strides
+        flat_frames = self.data.reshape((n_videos * n_frames, h, w, c))
+        return np.lib.stride_tricks.as_strided(
+            flat_frames,
+            shape=(n_videos * n_frames - self.input_n_frames + 1, h, w, self.input_n_frames, c),
+            strides=(sf, sh, sw, sf, sc),
+            writeable=False)
+
     def __len__(self):
         return len(self.data)
 
@@ -208,17 +273,17 @@ class TimeCorelatedDataset(Dataset):
         return (self.data.shape[0],) + self.data.shape[2:4] + (self.data.shape[4] * self.input_n_frames,)
 
     def get_pairs(self, idx):
-        selected_videos = self.data[idx, ...]
-        num_frames = [len(x) for x in selected_videos]
-        max_starting_frames_allowed = [n - (self.input_n_frames * 2) for n in num_frames]
-        starting_frames = [np.random.randint(0, m) for m in max_starting_frames_allowed]
+        idx = np.asarray(idx)
+        starting_frames = np.random.randint(0, self.n_starts, size=len(idx))
+        window_starts = idx * self.n_frames + starting_frames
 
-        input_frames = [x[start:(start + self.input_n_frames)] for x, start in zip(selected_videos, starting_frames)]
-        prediction_ground_truth = [x[(start + self.input_n_frames):(start + self.input_n_frames * 2)] for x, start in zip(selected_videos, starting_frames)]
+        # one gather per window type; reshaping merges frames into channels
+        input_frames = self.windows[window_starts]
+        prediction_ground_truth = self.windows[window_starts + self.input_n_frames]
 
-        input_frames = [self.concatenate_frames_over_channels(x) for x in input_frames]
-        prediction_ground_truth = [self.concatenate_frames_over_channels(x) for x in prediction_ground_truth]
-        return np.array(input_frames), np.array(prediction_ground_truth)
+        batch_shape = input_frames.shape[:3] + (-1,)
+        return (to_float_images(input_frames.reshape(batch_shape)),
+                to_float_images(prediction_ground_truth.reshape(batch_shape)))
 
     def concatenate_frames_over_channels(self, x):
         t = np.transpose(x, (1, 2, 0, 3))
@@ -230,8 +295,8 @@ class TimeCorelatedDataset(Dataset):
         return t
 
     def get_original_frames_from_processed_samples(self, X):
-        orig_x = [self.undo_concatenated_frames_over_channel(x) for x in X]
-        return np.array(orig_x)
+        t = np.reshape(X, X.shape[0:3] + (self.input_n_frames, X.shape[3] // self.input_n_frames))
+        return np.transpose(t, (0, 3, 1, 2, 4))
 
     def get_some_random_samples(self):
         idx = np.random.randint(0, len(self.data), 4)
@@ -242,164 +307,242 @@ class TimeCorelatedDataset(Dataset):
 
 
 class BufferedDataset(object):
-
-    def __init__(self, datapath):
-        path = os.path.join(datapath, "*.npy")
-        self.filepaths = glob.glob(path)
+    """
+    Streams a folder of .npy shards described by a manifest (see
+    datasets/shards.py). Each epoch the shards are visited in random order,
+    memory mapped and read ahead read_ahead shards in advance by a background
+    thread, and batches are drawn at random from the rows of the current
+    shard. Rows that do not fill a last batch are served first from the next
+    shard, or from the next epoch.
+    """
+
+    def __init__(self, datapath, read_ahead=2):
+        self.datapath = datapath
+        self.read_ahead = read_ahead
+        self.manifest = shards.load_manifest(datapath)
+        self.filepaths = [os.path.join(datapath, s['file']) for s in self.manifest['shards']]
+        self.shard_rows = [s['rows'] for s in self.manifest['shards']]
         self.n_buffers = len(self.filepaths)
-        self.buffer = np.load(self.filepaths[0])
-        self.current_buffer = 0
-        self.current_mirror_buffer = 1
-
-        self.load_mirror_buffer_in_background()
-
-    def load_mirror_buffer_in_background(self):
-        self.loading_thread = threading.Thread(target=self._load_mirror_buffer_worker)
-        self.loading_thread.start()
-
-    def swap_buffers(self):
-        self.loading_thread.join()
-        self.buffer = self.mirror_buffer
-        self.mirror_buffer = None
-        self.current_buffer = (self.current_buffer + 1) % self.n_buffers
-        self.current_mirror_buffer = (self.current_buffer + 1) % self.n_buffers
-        self.load_mirror_buffer_in_background()
-        print("Swapped buffer {} in. Loading buffer {}...".format(self.current_buffer, self.current_mirror_buffer))
-        did_go_around = self.current_buffer % self.n_buffers == 0
-        return did_go_around
+        self.leftover = None
+
+    def _open_shard(self, shard_index):
+        return (shards.open_shard(self.filepaths[shard_index]),)
 
     def get_random_fixed_batch(self, n=32):
         np.random.seed(14)
-        perm = np.random.permutation(len(self.buffer))
-        x_data = self.buffer[perm[:n]]
+        shard_perm = np.random.permutation(self.n_buffers)
+        x_data, n_read = [], 0
+        for s in shard_perm:
+            if n_read >= n:
+                break
+            shard = self._open_shard(s)[0]
+            indx = np.sort(np.random.permutation(len(shard))[:n - n_read])
+            x_data.append(shard[indx])
+            n_read += len(indx)
         np.random.seed()
-        return x_data, np.zeros((n,))
+        return to_float_images(np.concatenate(x_data)), np.zeros((n,))
+
+    def generator(self, batchsize, prefetch=0, n_workers=1):
+        """
+        Yields (x_data, y_data, cursor) tuples over one epoch. prefetch, if
+        given, overrides the number of shards read ahead.
+        """
+        depth = prefetch if prefetch > 0 else self.read_ahead
+        reads = [(s, None) for s in np.random.permutation(self.n_buffers)]
+        reader = BatchPrefetcher(self._open_shard, reads, depth=depth, n_workers=1)
 
-    def generator(self, batchsize):
-        did_finish_an_epoch = False
         general_cursor = 0
-        while not did_finish_an_epoch:
-            perm = np.random.permutation(len(self.buffer))
-            n_data = len(self.buffer)
-            for b in range(0, n_data, batchsize):
-                if batchsize > n_data - b:
+        for shard, _ in reader:
+            perm = np.random.permutation(len(shard))
+            b = 0
+            if self.leftover is not None:
+                # complete the rows left by the previous shard first
+                b = batchsize - len(self.leftover)
+                if b > len(perm):
+                    self.leftover = np.concatenate([self.leftover, shard[np.sort(perm)]])
                     continue
+                x_data = np.concatenate([self.leftover, shard[np.sort(perm[:b])]])
+                self.leftover = None
                 general_cursor += batchsize
+                yield to_float_images(x_data), np.zeros((batchsize,), dtype=np.uint8), general_cursor
+            for b in range(b, len(perm), batchsize):
                 indx = perm[b:b + batchsize]
-                x_data, y_data = self.buffer[indx], np.zeros((batchsize,), dtype=np.uint8)
-                yield x_data, y_data, general_cursor
-            did_finish_an_epoch = self.swap_buffers()
-
-    def _load_mirror_buffer_worker(self):
-        self.mirror_buffer = np.load(self.filepaths[self.current_mirror_buffer])
+                if len(indx) < batchsize:
+                    self.leftover = np.array(shard[np.sort(indx)])
+                    break
+                general_cursor += batchsize
+                # sorted indices keep the reads of the memory map sequential
+                x_data = shard[np.sort(indx)]
+                yield to_float_images(x_data), np.zeros((batchsize,), dtype=np.uint8), general_cursor
 
     def __len__(self):
-        return len(self.buffer) * self.n_buffers
+        return sum(self.shard_rows)
 
     def _get_shape(self):
-        return [len(self)] + list(self.buffer.shape[1:])
+        return [len(self)] + list(self.manifest['shape'])
 
     shape = property(_get_shape)
 
 
 class LargeDataset(object):
-
-    def __init__(self, datapath, buffer_size=100000):
+    """
+    Streams an HDF5 'data' array that does not fit in memory. Each epoch the
+    chunk-aligned blocks of the array are read in random order by background
+    threads into a shuffle pool of pool_size rows, from which batches are
+    drawn at random. Rows that do not fill a last batch stay in the pool and
+    are served first in the next epoch, so no row is ever skipped. An epoch
+    left before its end carries nothing over: the next one starts from an
+    empty pool.
+    """
+
+    def __init__(self, datapath, pool_size=20000, block_size=None, n_readers=2):
 
         self.datapath = datapath
         self.file = h5py.File(self.datapath, 'r')
         self.data_ref = self.file['data']
-        self.n_buffers = len(self.data_ref) // buffer_size
-        self.buffer_size = buffer_size
-        self.buffer = self.data_ref[0:self.buffer_size, ...]
-        self.current_buffer = 0
-        self.current_mirror_buffer = 1
-
-        self.load_mirror_buffer_in_background()
-
-    def load_mirror_buffer_in_background(self):
-        self.loading_thread = threading.Thread(target=self._load_mirror_buffer_worker)
-        self.loading_thread.start()
-
-    def swap_buffers(self):
-        self.loading_thread.join()
-        self.buffer = self.mirror_buffer
-        self.mirror_buffer = None
-        self.current_buffer = (self.current_buffer + 1) % self.n_buffers
-        self.current_mirror_buffer = (self.current_buffer + 1) % self.n_buffers
-        self.load_mirror_buffer_in_background()
-        print("Swapped buffer {} in. Loading buffer {}...".format(self.current_buffer, self.current_mirror_buffer))
-        did_go_around = self.current_buffer % self.n_buffers == 0
-        return did_go_around
+        self.pool_size = pool_size
+        self.n_readers = n_readers
+
+        # align reads to the hdf5 chunks so that no chunk is decoded twice
+        if block_size is None:
+            if self.data_ref.chunks is not None:
+                block_size = self.data_ref.chunks[0]
+                block_size *= max(1, 1024 // block_size)
+            else:
+                block_size = 1024
+        self.block_size = block_size
+
+        n_data = len(self.data_ref)
+        self.blocks = [(b, min(b + block_size, n_data)) for b in range(0, n_data, block_size)]
+
+        self.pool = np.empty((pool_size + block_size,) + self.data_ref.shape[1:], dtype=self.data_ref.dtype)
+        self.pool_count = 0
+
+    def _read_block(self, block):
+        start, stop = block
+        return (self.data_ref[start:stop],)
+
+    def _split_pool(self, pool_count, batchsize, keep):
+        """
+        Shuffles the first pool_count rows of the pool into random batches
+        until only keep rows, or up to a batch more, are left. Returns the
+        indices of the batches and of the remaining rows.
+        """
+        perm = np.random.permutation(pool_count)
+        n_served = max(0, (pool_count - keep) // batchsize) * batchsize
+        return [perm[b:b + batchsize] for b in range(0, n_served, batchsize)], perm[n_served:]
+
+    def _keep_rows(self, remaining):
+        """
+        Moves the remaining rows to the start of the pool, returns their number
+        """
+        self.pool[:len(remaining)] = self.pool[remaining]
+        return len(remaining)
 
     def get_random_fixed_batch(self, n=32):
         np.random.seed(14)
-        perm = np.random.permutation(len(self.buffer))
-        x_data = self.buffer[perm[:n]]
+        block_perm = np.random.permutation(len(self.blocks))
         np.random.seed()
+        x_data, n_read = [], 0
+        for b in block_perm:
+            if n_read >= n:
+                break
+            x_data.append(self._read_block(self.blocks[b])[0])
+            n_read += len(x_data[-1])
+        x_data = to_float_images(np.concatenate(x_data)[:n])
         return x_data, np.zeros((n,))
 
-    def generator(self, batchsize):
-        did_finish_an_epoch = False
+    def generator(self, batchsize, prefetch=0, n_workers=1):
+        """
+        Yields (x_data, y_data, cursor) tuples over one epoch. Blocks are
+        always read in background threads; prefetch and n_workers, if given,
+        override the number of queued blocks and of reader threads.
+        """
+        if batchsize > self.pool_size // 2:
+            raise ValueError("The shuffle pool must hold at least two batches")
+        n_readers = n_workers if prefetch > 0 else self.n_readers
+        depth = prefetch if prefetch > 0 else 2 * n_readers
+        block_perm = np.random.permutation(len(self.blocks))
+        reads = [(self.blocks[b], None) for b in block_perm]
+        reader = BatchPrefetcher(self._read_block, reads, depth=depth, n_workers=n_readers)
+
+        # the rows left by the previous epoch, if it was completed
+        pool_count, self.pool_count = self.pool_count, 0
         general_cursor = 0
-        while not did_finish_an_epoch:
-            perm = np.random.permutation(len(self.buffer))
-            n_data = len(self.buffer)
-            for b in range(0, n_data, batchsize):
-                if batchsize > n_data - b:
-                    continue
+        try:
+            for block_data, _ in reader:
+                self.pool[pool_count:pool_count + len(block_data)] = block_data
+                pool_count += len(block_data)
+                if pool_count >= self.pool_size:
+                    batches, remaining = self._split_pool(pool_count, batchsize, keep=self.pool_size // 2)
+                    for indx in batches:
+                        general_cursor += batchsize
+                        yield to_float_images(self.pool[indx]), np.zeros((batchsize,), dtype=np.uint8), general_cursor
+                    pool_count = self._keep_rows(remaining)
+
+            # leftovers smaller than a batch are carried over to the next epoch
+            batches, remaining = self._split_pool(pool_count, batchsize, keep=0)
+            for indx in batches:
                 general_cursor += batchsize
-                indx = perm[b:b + batchsize]
-                x_data, y_data = self.buffer[indx], np.zeros((batchsize,), dtype=np.uint8)
-                yield x_data, y_data, general_cursor
-            did_finish_an_epoch = self.swap_buffers()
-
-    def _load_mirror_buffer_worker(self):
-        current_pointer = self.buffer_size * self.current_mirror_buffer
-        next_stop = np.min((current_pointer + self.buffer_size, len(self.data_ref)))
-        self.mirror_buffer = self.data_ref[current_pointer:next_stop, ...]
+                yield to_float_images(self.pool[indx]), np.zeros((batchsize,), dtype=np.uint8), general_cursor
+            self.pool_count = self._keep_rows(remaining)
+        finally:
+            reader.close()
 
     def __len__(self):
         return len(self.data_ref)
 
     def _get_shape(self):
-        return [len(self)] + list(self.buffer.shape[1:])
+        return [len(self)] + list(self.data_ref.shape[1:])
 
     shape = property(_get_shape)
 
 
-def load_dataset(dataset_name):
+def load_dataset(dataset_name, uint8_storage=False, use_cache=True, shuffle_pool=20000):
+    """
+    uint8_storage: keep in-memory images as uint8 and scale them to float32
+    only when a batch is requested (mnist, svhn and cifar10 variants)
+    use_cache: store the preprocessed arrays of the in-memory datasets on disk
+    the first time they are loaded and memory map them afterwards
+    shuffle_pool: number of rows kept in memory to shuffle streamed datasets
+    (lsun-bedroom, celeba)
+    """
+    def load(module, **options):
+        if use_cache:
+            return cached_load(dataset_name, module.load_data, module.source_files, **options)
+        return module.load_data(**options)
+
     if dataset_name == 'mnist':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = mnist.load_data()
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(mnist, as_uint8=uint8_storage)
     elif dataset_name == 'mnist-original':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = mnist.load_data(original=True)
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(mnist, original=True, as_uint8=uint8_storage)
     elif dataset_name == 'mnist-rgb':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = mnist.load_data(use_rgb=True)
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(mnist, use_rgb=True, as_uint8=uint8_storage)
     elif dataset_name == 'svhn':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = svhn.load_data()
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(svhn, as_uint8=uint8_storage)
     elif dataset_name == 'svhn-extra':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = svhn.load_data(include_extra=True)
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(svhn, include_extra=True, as_uint8=uint8_storage)
     elif dataset_name == 'mnist-svhn':
-        anchor = load_dataset('mnist-rgb')
-        mirror = load_dataset('svhn')
+        anchor = load_dataset('mnist-rgb', uint8_storage=uint8_storage, use_cache=use_cache)
+        mirror = load_dataset('svhn', uint8_storage=uint8_storage, use_cache=use_cache)
         dataset = CrossDomainDatasets(dataset_name.replace('-', ''), anchor, mirror)
     elif dataset_name == 'cifar10':
         dataset = ConditionalDataset(name=dataset_name.replace('-', ''))
-        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = cifar10.load_data()
+        dataset.images, dataset.attrs, dataset.x_test, dataset.y_test, dataset.attr_names = load(cifar10, as_uint8=uint8_storage)
     elif dataset_name == 'moving-mnist':
-        data = moving_mnist.load_data()
+        data = moving_mnist.load_data(as_uint8=uint8_storage)
         dataset = TimeCorelatedDataset(dataset_name.replace('-', ''), data)
     elif dataset_name == 'lsun-bedroom':
         datapath = lsun.load_data()
-        dataset = LargeDataset(datapath)
+        dataset = LargeDataset(datapath, pool_size=shuffle_pool)
     elif dataset_name == 'celeba':
         datapath = celeba.load_data()
-        dataset = LargeDataset(datapath)
+        dataset = LargeDataset(datapath, pool_size=shuffle_pool)
     else:
         raise KeyError("Dataset not implemented")
 
@@ -0,0 +1,129 @@
+"""
+Parallel ingestion of image folders and zip archives into chunked uint8 HDF5
+files. Images are decoded and resized by a pool of processes, read straight
+from the archive when the source is a zip file, and written in large batches.
+
+Usage:
+    python -m datasets.ingest img_align_celeba.zip celeba.h5 --size 64 --compression lzf
+"""
+import os
+import io
+import time
+import glob
+import zipfile
+import argparse
+import functools
+import itertools
+import multiprocessing
+
+import numpy as np
+import h5py
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# per-process handle of the zip archive being ingested
+_source_zip = None
+
+
+def center_crop_resize(image, size=64):
+    """
+    Crops the largest centered square of image and resizes it to size x size
+    """
+    w, h = image.size
+    smallest_size = min(w, h)
+    left = (w - smallest_size) // 2
+    top = (h - smallest_size) // 2
+    image = image.crop((left, top, left + smallest_size, top + smallest_size))
+    return image.resize((size, size), Image.BILINEAR)
+
+
+def list_images(source):
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source, 'r') as zf:
+            names = zf.namelist()
+    else:
+        names = glob.glob(os.path.join(source, '**', '*'), recursive=True)
+    return sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _init_worker(source):
+    global _source_zip
+    if zipfile.is_zipfile(source):
+        _source_zip = zipfile.ZipFile(source, 'r')
+
+
+def _decode_batch(names, preprocess):
+    images = []
+    for name in names:
+        if _source_zip is not None:
+            fp = io.BytesIO(_source_zip.read(name))
+        else:
+            fp = open(name, 'rb')
+        with fp:
+            image = Image.open(fp).convert('RGB')
+            images.append(np.asarray(preprocess(image), dtype=np.uint8))
+    return np.stack(images)
+
+
+def ingest_images(source, h5_filepath, preprocess=None, img_size=64,
+                  dataset_name='data', n_workers=None, batch_size=1000,
+                  chunk_rows=256, compression=None, mode='w'):
+    """
+    Decodes every image found in source (a folder or a zip file) with a pool
+    of n_workers processes and stores them, in sorted name order, as a uint8
+    (N, H, W, 3) dataset of h5_filepath chunked by chunk_rows images.
+
+    preprocess: picklable callable mapping a PIL image to an HxWx3 image,
+                defaults to a center crop resized to img_size
+    compression: optional h5py compression filter, e.g. 'lzf' or 'gzip'
+    Returns the list of ingested image names.
+    """
+    if preprocess is None:
+        preprocess = functools.partial(center_crop_resize, size=img_size)
+    n_workers = n_workers or multiprocessing.cpu_count()
+
+    names = list_images(source)
+    n_images = len(names)
+    if n_images == 0:
+        raise ValueError("No images found in {}".format(source))
+    batches = [names[b:b + batch_size] for b in range(0, n_images, batch_size)]
+
+    start = time.time()
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(source,))
+    try:
+        decoded = pool.imap(functools.partial(_decode_batch, preprocess=preprocess), batches)
+        first = next(decoded)
+        with h5py.File(h5_filepath, mode=mode) as hdf5_file:
+            dset = hdf5_file.create_dataset(dataset_name, (n_images,) + first.shape[1:], np.uint8,
+                                            chunks=(min(chunk_rows, n_images),) + first.shape[1:],
+                                            compression=compression)
+            count = 0
+            for images in itertools.chain([first], decoded):
+                dset[count:count + len(images)] = images
+                count += len(images)
+                elapsed = time.time() - start
+                print('Ingested {}/{} images ({:.1f} img/s)'.format(count, n_images, count / elapsed),
+                      end='\r', flush=True)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    print('\nIngested {} images in {:.1f}s ({:.1f} img/s)'.format(n_images, elapsed, n_images / elapsed))
+    return names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest an image folder or zip file into HDF5')
+    parser.add_argument('source', type=str)
+    parser.add_argument('output', type=str)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--chunk-rows', type=int, default=256)
+    parser.add_argument('--compression', type=str, default=None, choices=['lzf', 'gzip'])
+    args = parser.parse_args()
+
+    ingest_images(args.source, args.output, img_size=args.size,
+                  n_workers=args.workers, batch_size=args.batch_size,
+                  chunk_rows=args.chunk_rows, compression=args.compression)
@@ -1,7 +1,19 @@
+import os
+
 import numpy as np
 import keras
 
-def load_data(original=False, use_rgb=False):
+keras_file = os.path.join(os.path.expanduser('~'), '.keras', 'datasets', 'mnist.npz')
+
+
+def source_files(**kwargs):
+    """
+    Raw files read by load_data, used to invalidate the dataset cache
+    """
+    return [keras_file]
+
+
+def load_data(original=False, use_rgb=False, as_uint8=False):
     (x_train, y_train), (x_test, y_test) = keras.datasets.mnist.load_data()
 
     if not original:
@@ -15,8 +27,9 @@ def load_data(original=False, use_rgb=False):
     else:
         x_train = (x_train[:, :, :, np.newaxis])
         x_test = (x_test[:, :, :, np.newaxis])
-    x_train = x_train.astype('float32')/255.
-    x_test = x_test.astype('float32')/255.
+    if not as_uint8:
+        x_train = x_train.astype('float32')/255.
+        x_test = x_test.astype('float32')/255.
     y_train = keras.utils.to_categorical(y_train)
     y_train = y_train.astype('float32')
 
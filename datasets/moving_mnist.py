@@ -35,7 +35,7 @@ def download_moving_mnist():
         sys.stdout.write('\nFinish!\n')
         sys.stdout.flush()
 
-def load_data():
+def load_data(as_uint8=False):
     """
     Load and return dataset as tuple (data, label, label_strings)
     """
@@ -44,8 +44,9 @@ def load_data():
         download_moving_mnist()
 
     data = np.load(outfile)
-    data = np.moveaxis(data, 1, 0) # fix inverted axis setup
-    data = (data / 255.0).astype('float32')
+    data = np.ascontiguousarray(np.moveaxis(data, 1, 0)) # fix inverted axis setup
+    if not as_uint8:
+        data = (data / 255.0).astype('float32')
     data = np.expand_dims(data, -1)
 
     return data
@@ -0,0 +1,90 @@
+import threading
+import queue
+import math
+
+
+class _WorkerError(object):
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class BatchPrefetcher(object):
+    """
+    Assembles batches in background threads and hands them out, in order,
+    through bounded queues.
+
+    make_batch: callable receiving an index array and returning a tuple
+    batches: list of (indices, cursor) describing one epoch
+    depth: total number of ready batches kept ahead of the consumer
+    n_workers: number of assembling threads, batch i is built by worker i % n
+    """
+
+    def __init__(self, make_batch, batches, depth=4, n_workers=1):
+        self.make_batch = make_batch
+        self.batches = batches
+        self.n_workers = max(1, min(n_workers, len(batches)))
+        queue_size = max(1, int(math.ceil(depth / self.n_workers)))
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.n_workers)]
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for w in range(self.n_workers):
+            thread = threading.Thread(target=self._worker, args=(w,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, worker_id):
+        q = self.queues[worker_id]
+        for indx, cursor in self.batches[worker_id::self.n_workers]:
+            try:
+                item = tuple(self.make_batch(indx)) + (cursor,)
+            except Exception as e:
+                self._put(q, _WorkerError(e))
+                return
+            if not self._put(q, item):
+                return
+
+    def close(self):
+        self.stop_event.set()
+        for q in self.queues:
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __iter__(self):
+        self.start()
+        try:
+            for b in range(len(self.batches)):
+                item = self.queues[b % self.n_workers].get()
+                if isinstance(item, _WorkerError):
+                    raise item.exception
+                yield item
+        finally:
+            self.close()
+
+
+def iterate_batches(make_batch, batches, prefetch=0, n_workers=1):
+    """
+    Yields (*make_batch(indices), cursor) for every entry of batches, either
+    synchronously or, if prefetch > 0, from a BatchPrefetcher
+    """
+    if prefetch > 0 and len(batches) > 0:
+        return iter(BatchPrefetcher(make_batch, batches, depth=prefetch, n_workers=n_workers))
+    return (tuple(make_batch(indx)) + (cursor,) for indx, cursor in batches)
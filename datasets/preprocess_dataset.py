@@ -1,48 +1,69 @@
-import random
+import argparse
 
 import h5py
-import sys
 import numpy as np
 
 from tqdm import tqdm
 
 
-def main(filename):
-    f = h5py.File(filename)
-    num_images = f['images'].shape[0]
+def normalize(images, dtype='float32', value_range=(-1., 1.)):
+    """
+    Maps uint8 pixels to value_range in the given float dtype. uint8 outputs
+    keep the raw pixel values.
+    """
+    if np.dtype(dtype) == np.uint8:
+        return images.astype(np.uint8, copy=False)
+    low, high = value_range
+    images = images.astype('float32') / 255.
+    return (images * (high - low) + low).astype(dtype, copy=False)
 
-    batch_size = 20 * 1000
 
-    with h5py.File(filename.replace('.hdf5', '_pr.hdf5')) as hdf5_file:
-        dset = hdf5_file.create_dataset('images', dtype='float32', shape=(0, 64, 64, 3),
-                                        maxshape=(num_images, 64, 64, 3))
+def main(filename, output=None, dataset_name='images', dtype='float32',
+         value_range=(-1., 1.), block_rows=4096, window_blocks=8, chunk_rows=1024):
+    """
+    Writes a shuffled and normalized copy of the dataset_name array of
+    filename. Contiguous blocks of block_rows rows are read in random order,
+    window_blocks of them at a time, and the rows of each window are permuted
+    in memory before being written in chunk_rows batches into a preallocated
+    destination.
+    """
+    if output is None:
+        output = filename.replace('.hdf5', '_pr.hdf5')
 
-        image_data = []
+    with h5py.File(filename, 'r') as f, h5py.File(output, 'w') as hdf5_file:
+        src = f[dataset_name]
+        num_images = src.shape[0]
+        dset = hdf5_file.create_dataset(dataset_name, dtype=dtype, shape=src.shape,
+                                        chunks=(min(chunk_rows, num_images),) + src.shape[1:])
 
-        # shuffle the dataset
-        idxs = [idx for idx in range(num_images)]
-        random.shuffle(idxs)
-        for idx in tqdm(idxs):
-            image = f['images'][idx]
-            image_data.append(image)
-
-            if len(image_data) == batch_size:
-                dset.resize(dset.shape[0] + batch_size, axis=0)
-                image_data = np.asarray(image_data, 'float32') / 255.
-                image_data = image_data * 2.0 - 1.0
-                dset[-batch_size:] = image_data
-                image_data = []
-
-        if len(image_data) != 0:
-            # append the last, not full batch
-            rows_in_batch = len(image_data)
-            dset.resize(dset.shape[0] + rows_in_batch, axis=0)
-            image_data = np.asarray(image_data, 'float32') / 255.
-            image_data = image_data * 2.0 - 1.0
-            dset[-rows_in_batch:] = image_data
+        # shuffle the dataset: random block order, random rows inside a window
+        blocks = [(b, min(b + block_rows, num_images)) for b in range(0, num_images, block_rows)]
+        blocks = [blocks[i] for i in np.random.permutation(len(blocks))]
+        cursor = 0
+        for w in tqdm(range(0, len(blocks), window_blocks)):
+            window = np.concatenate([src[start:stop] for start, stop in blocks[w:w + window_blocks]])
+            window = window[np.random.permutation(len(window))]
+            for b in range(0, len(window), chunk_rows):
+                image_data = normalize(window[b:b + chunk_rows], dtype, value_range)
+                dset[cursor:cursor + len(image_data)] = image_data
+                cursor += len(image_data)
 
         print(dset.shape)
 
 
 if __name__ == '__main__':
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Shuffle and normalize an HDF5 image dataset')
+    parser.add_argument('filename', type=str)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--dataset-name', type=str, default='images')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float16', 'float32', 'uint8'])
+    parser.add_argument('--range', type=float, nargs=2, default=[-1., 1.],
+                        help="target range of float outputs")
+    parser.add_argument('--block-rows', type=int, default=4096)
+    parser.add_argument('--window-blocks', type=int, default=8)
+    parser.add_argument('--chunk-rows', type=int, default=1024)
+    args = parser.parse_args()
+
+    main(args.filename, output=args.output, dataset_name=args.dataset_name,
+         dtype=args.dtype, value_range=tuple(args.range), block_rows=args.block_rows,
+         window_blocks=args.window_blocks, chunk_rows=args.chunk_rows)
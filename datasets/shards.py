@@ -0,0 +1,106 @@
+"""
+Sharded on-disk dataset format: a folder of .npy shards plus a manifest.json
+with the number of rows of every shard, the dtype and the shape of a row.
+
+Usage:
+    python -m datasets.shards lsun.h5 lsun_shards --rows-per-shard 20000
+"""
+import os
+import glob
+import json
+import argparse
+
+import numpy as np
+import h5py
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def write_shards(out_dir, data, rows_per_shard=20000):
+    """
+    Splits data (a numpy array or an hdf5 dataset) into .npy shards of
+    rows_per_shard rows stored in out_dir, and writes their manifest
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    shards = []
+    for i, b in enumerate(range(0, len(data), rows_per_shard)):
+        filename = 'shard_{:05d}.npy'.format(i)
+        rows = np.asarray(data[b:b + rows_per_shard])
+        np.save(os.path.join(out_dir, filename), rows)
+        shards.append({'file': filename, 'rows': len(rows)})
+        print('Wrote shard {} ({} rows)'.format(filename, len(rows)), end='\r', flush=True)
+    manifest = {'version': MANIFEST_VERSION,
+                'dtype': np.dtype(data.dtype).str,
+                'shape': list(data.shape[1:]),
+                'shards': shards}
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print('\nWrote {} shards to {}'.format(len(shards), out_dir))
+    return manifest
+
+
+def build_manifest(datapath):
+    """
+    Builds the manifest of a folder of .npy files lacking one, reading only
+    the headers of the files
+    """
+    shards = []
+    dtype, shape = None, None
+    for filepath in sorted(glob.glob(os.path.join(datapath, '*.npy'))):
+        shard = np.load(filepath, mmap_mode='r')
+        if dtype is None:
+            dtype, shape = shard.dtype, shard.shape[1:]
+        elif shard.dtype != dtype or shard.shape[1:] != shape:
+            raise ValueError("Shard {} does not match the dtype and shape "
+                             "of the other shards".format(filepath))
+        shards.append({'file': os.path.basename(filepath), 'rows': len(shard)})
+    if not shards:
+        raise ValueError("No .npy shards found in {}".format(datapath))
+    return {'version': MANIFEST_VERSION,
+            'dtype': dtype.str,
+            'shape': list(shape),
+            'shards': shards}
+
+
+def load_manifest(datapath):
+    manifest_path = os.path.join(datapath, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return build_manifest(datapath)
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("Unsupported shard manifest version {}".format(manifest.get('version')))
+    return manifest
+
+
+def open_shard(filepath):
+    """
+    Memory maps a shard and asks the OS to start reading it into the page
+    cache, so that random row accesses later on do not wait on the disk
+    """
+    shard = np.load(filepath, mmap_mode='r')
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    else:
+        with open(filepath, 'rb') as f:
+            while f.read(1 << 24):
+                pass
+    return shard
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split an HDF5 dataset into .npy shards')
+    parser.add_argument('filename', type=str)
+    parser.add_argument('out_dir', type=str)
+    parser.add_argument('--dataset-name', type=str, default='data')
+    parser.add_argument('--rows-per-shard', type=int, default=20000)
+    args = parser.parse_args()
+
+    with h5py.File(args.filename, 'r') as f:
+        write_shards(args.out_dir, f[args.dataset_name], rows_per_shard=args.rows_per_shard)
@@ -62,15 +62,28 @@ def download_svhn_extra():
         sys.stdout.flush()
 
 
-def preprocess(X):
+def preprocess(X, as_uint8=False):
     X = np.transpose(X, axes=[3, 0, 1, 2])
+    if as_uint8:
+        return np.ascontiguousarray(X, dtype=np.uint8)
     X = (X / 255.0).astype('float32')
     return X
 
 
-def load_data(include_extra=False):
+def source_files(include_extra=False, **kwargs):
+    """
+    Raw files read by load_data, used to invalidate the dataset cache
+    """
+    if include_extra:
+        return [outfile_train, outfile_test, outfile_extra]
+    return [outfile_train, outfile_test]
+
+
+def load_data(include_extra=False, as_uint8=False):
     """
     Load and return dataset as tuple (data, label, label_strings)
+    If as_uint8 is set, images are returned as raw uint8 pixels instead of
+    float32 in [0, 1]
     """
 
     if not os.path.exists(outfile_train):
@@ -94,8 +107,8 @@ def load_data(include_extra=False):
         x_train = np.concatenate((x_train, mat_e['X']), axis=-1)
         y_train = np.concatenate((y_train, mat_e['y']), axis=0)
 
-    x_train = preprocess(x_train)
-    x_test = preprocess(x_test)
+    x_train = preprocess(x_train, as_uint8=as_uint8)
+    x_test = preprocess(x_test, as_uint8=as_uint8)
     y_train[y_train == 10] = 0
     y_test[y_test == 10] = 0
     y_test = np.squeeze(y_test)
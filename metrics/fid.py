@@ -0,0 +1,91 @@
+'''
+Frechet Inception Distance between generated and real images, computed on
+the final pool activations of the inception network of the inception score.
+The statistics of the real images are computed once and stored on disk,
+keyed by a hash of the images and of the preprocessing.
+
+https://arxiv.org/abs/1706.08500
+'''
+import os
+import time
+import hashlib
+
+import numpy as np
+
+from metrics import inception_score
+
+STATS_DIR = './datasets/fid_stats'
+# changing how images reach the activations invalidates the stored statistics
+PREPROCESSING = '{}|{}|rgb-0-255|bilinear-299'.format(inception_score.INCEPTION_FROZEN_GRAPH,
+                                                      inception_score.INCEPTION_FINAL_POOL)
+
+
+def get_stats_key(images):
+    """
+    Hash of the content of images, their dtype and shape and the
+    preprocessing they go through
+    """
+    images = np.ascontiguousarray(images)
+    h = hashlib.sha1()
+    h.update('{}|{}|{}'.format(PREPROCESSING, images.dtype.str, images.shape).encode('utf8'))
+    h.update(images.data)
+    return h.hexdigest()
+
+
+def sqrt_psd(matrix):
+    """
+    Square root of a symmetric positive semi-definite matrix
+    """
+    w, v = np.linalg.eigh(matrix)
+    return (v * np.sqrt(np.clip(w, 0, None))) @ v.T
+
+
+def get_statistics(activations):
+    return activations.mean(axis=0), np.cov(activations, rowvar=False)
+
+
+def get_real_statistics(images, key, stats_dir=STATS_DIR):
+    """
+    Returns (mu, sigma, sqrt_sigma) of the activations of images, the real
+    images in [N, HEIGHT, WIDTH, 3] format with values from 0 to 255, loaded
+    from stats_dir if they were computed before
+    """
+    filename = os.path.join(stats_dir, 'fid_stats_{}.npz'.format(key))
+    if os.path.exists(filename):
+        with np.load(filename) as stats:
+            return stats['mu'], stats['sigma'], stats['sqrt_sigma']
+
+    start = time.time()
+    mu, sigma = get_statistics(inception_score.get_scorer().get_activations(images))
+    sqrt_sigma = sqrt_psd(sigma)
+    if not os.path.isdir(stats_dir):
+        os.makedirs(stats_dir)
+    tmp_filename = filename + '.tmp.npz'
+    np.savez(tmp_filename, mu=mu, sigma=sigma, sqrt_sigma=sqrt_sigma)
+    os.replace(tmp_filename, filename)
+    print("[FID] Statistics of {} real images took {:.1f}s".format(len(images), time.time() - start))
+    return mu, sigma, sqrt_sigma
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2, sqrt_sigma2):
+    """
+    ||mu1 - mu2||^2 + Tr(sigma1 + sigma2 - 2 (sigma1 sigma2)^(1/2)), with the
+    trace of the root taken from the eigenvalues of the symmetric matrix
+    sigma2^(1/2) sigma1 sigma2^(1/2), which has the same spectrum
+    """
+    eigenvalues = np.linalg.eigvalsh(sqrt_sigma2 @ sigma1 @ sqrt_sigma2)
+    tr_covmean = np.sqrt(np.clip(eigenvalues, 0, None)).sum()
+    diff = mu1 - mu2
+    return diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * tr_covmean
+
+
+def get_fid(generated_images, real_images, real_key=None, stats_dir=STATS_DIR):
+    """
+    FID of generated_images to real_images, both in [N, HEIGHT, WIDTH, 3]
+    format with values from 0 to 255
+    """
+    if real_key is None:
+        real_key = get_stats_key(real_images)
+    real_stats = get_real_statistics(real_images, real_key, stats_dir)
+    mu, sigma = get_statistics(inception_score.get_scorer().get_activations(generated_images))
+    return frechet_distance(mu, sigma, *real_stats)
@@ -1,8 +1,9 @@
 '''
-MMD functions implemented in tensorflow.
+MMD functions implemented in tensorflow, plus a numpy linear-time estimator.
 '''
 from __future__ import division
 
+import numpy as np
 import tensorflow as tf
 import functools
 
@@ -77,6 +78,80 @@ def mix_rbf_mmd2_and_ratio(X, Y, sigmas=(1,), wts=None, biased=True):
     return _mmd2_and_ratio(K_XX, K_XY, K_YY, const_diagonal=d, biased=biased)
 
 
+################################################################################
+### Blocked quadratic-time and linear-time MMD with Gaussian RBF kernels
+
+
+def _rbf_kernel_sums(A, B, sigmas):
+    "The sums of the RBF kernel values between the rows of A and B, one per sigma."
+    A_sqnorms = tf.reduce_sum(tf.square(A), 1)
+    B_sqnorms = tf.reduce_sum(tf.square(B), 1)
+    sqdists = tf.maximum(tf.expand_dims(A_sqnorms, 1) + tf.expand_dims(B_sqnorms, 0)
+                         - 2 * tf.matmul(A, B, transpose_b=True), 0.)
+    return tf.stack([tf.reduce_sum(tf.cast(tf.exp(-sqdists / (2 * sigma**2)), tf.float64))
+                     for sigma in sigmas])
+
+
+class BlockedMMD(object):
+    """
+    Quadratic-time MMD^2 estimates for several RBF bandwidths in one pass,
+    without materializing the kernel matrices: kernel sums are accumulated
+    over blocks of block_size rows and columns, fed to a graph built once,
+    so memory stays around block_size^2 values per bandwidth. Only the
+    upper triangle of blocks of K_XX and K_YY is computed.
+    """
+
+    def __init__(self, n_features, sigmas=(1,), block_size=1000):
+        self.sigmas = list(sigmas)
+        self.block_size = block_size
+        self.A = tf.placeholder(tf.float32, shape=[None, n_features], name='mmd_block_a')
+        self.B = tf.placeholder(tf.float32, shape=[None, n_features], name='mmd_block_b')
+        self.kernel_sums = _rbf_kernel_sums(self.A, self.B, self.sigmas)
+
+    def _sum(self, session, A, B, symmetric=False):
+        total = np.zeros(len(self.sigmas))
+        for i in range(0, len(A), self.block_size):
+            for j in range(i if symmetric else 0, len(B), self.block_size):
+                sums = session.run(self.kernel_sums, feed_dict={self.A: A[i:i + self.block_size],
+                                                                self.B: B[j:j + self.block_size]})
+                total += sums if not symmetric or i == j else 2 * sums
+        return total
+
+    def mmd2(self, session, X, Y, biased=True):
+        """
+        Returns the MMD^2 estimate of every sigma between the samples X and Y
+        """
+        X = np.asarray(X, dtype=np.float32).reshape(len(X), -1)
+        Y = np.asarray(Y, dtype=np.float32).reshape(len(Y), -1)
+        m, n = len(X), len(Y)
+        K_XX_sum = self._sum(session, X, X, symmetric=True)
+        K_YY_sum = self._sum(session, Y, Y, symmetric=True)
+        K_XY_sum = self._sum(session, X, Y)
+        if biased:
+            return K_XX_sum / (m * m) + K_YY_sum / (n * n) - 2 * K_XY_sum / (m * n)
+        # the diagonals of K_XX and K_YY are all ones
+        return ((K_XX_sum - m) / (m * (m - 1))
+                + (K_YY_sum - n) / (n * (n - 1))
+                - 2 * K_XY_sum / (m * n))
+
+
+def linear_mmd2(X, Y, sigmas=(1,)):
+    """
+    Linear-time unbiased MMD^2 estimate of every sigma (Gretton et al. 2012,
+    lemma 14) from consecutive pairs of samples of X and Y, in numpy
+    """
+    n = min(len(X), len(Y)) // 2 * 2
+    X = np.asarray(X[:n], dtype=np.float32).reshape(n, -1)
+    Y = np.asarray(Y[:n], dtype=np.float32).reshape(n, -1)
+    sqdist = lambda a, b: np.sum(np.square(a - b), axis=1, dtype=np.float64)
+    d_xx = sqdist(X[0::2], X[1::2])
+    d_yy = sqdist(Y[0::2], Y[1::2])
+    d_xy = sqdist(X[0::2], Y[1::2])
+    d_yx = sqdist(X[1::2], Y[0::2])
+    k = lambda d, sigma: np.exp(-d / (2 * sigma**2))
+    return np.array([np.mean(k(d_xx, s) + k(d_yy, s) - k(d_xy, s) - k(d_yx, s)) for s in sigmas])
+
+
 ################################################################################
 ### Helper functions to compute variances based on kernel matrices
 
@@ -0,0 +1,114 @@
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedShuffleSplit
+
+from core.metrics import HistoryMetric
+
+
+def predict(model, x):
+    W, b, classes = model
+    scores = x.dot(W) + b
+    if scores.shape[1] == 1:
+        return classes[(scores[:, 0] > 0).astype(int)]
+    return classes[np.argmax(scores, axis=1)]
+
+
+def accuracy(model, x, y):
+    return np.mean(predict(model, x) == y)
+
+
+class LinearProbeEval(HistoryMetric):
+    """
+    Test accuracy of a linear probe of the embeddings, evaluated like
+    SVMEval: on each of n_splits stratified splits of 1000 training samples
+    the best of c_values is selected on held out samples, and the probe is
+    refit on the whole training set with it. Features are standardized
+    once for all the splits, the splits are evaluated in parallel threads
+    and every distinct selected C is refit only once.
+    """
+    input_type = 'labelled_embedding'
+    process_safe = True
+    c_values = [1e1, 1e2, 1e-1]
+    n_splits = 5
+    n_workers = 5
+
+    @abstractmethod
+    def fit(self, x, y, c_values):
+        """
+        Returns one (W, b, classes) linear model of x to y per C value
+        """
+        pass
+
+    def select_c(self, x, y, split):
+        train, val = split
+        models = self.fit(x[train], y[train], self.c_values)
+        scores = [accuracy(model, x[val], y[val]) for model in models]
+        # ties go to the first C, as in GridSearchCV
+        return self.c_values[int(np.argmax(scores))]
+
+    def compute(self, input_data):
+        if len(input_data) == 2:
+            x_feats, y_labels = input_data
+            x_train, y_train, x_test, y_test = x_feats[1000:], y_labels[1000:], x_feats[:1000], y_labels[:1000]
+        else:
+            x_train, y_train, x_test, y_test = input_data
+        y_train, y_test = np.asarray(y_train), np.asarray(y_test)
+
+        # rescale data once, every split reuses it
+        x_train = np.asarray(x_train, dtype=np.float64)
+        mean, std = x_train.mean(axis=0), x_train.std(axis=0)
+        std[std == 0] = 1.
+        x_train = (x_train - mean) / std
+        x_test = (np.asarray(x_test, dtype=np.float64) - mean) / std
+
+        splits = StratifiedShuffleSplit(
+            n_splits=self.n_splits, train_size=1000, test_size=0.2).split(x_train, y_train)
+        with ThreadPoolExecutor(self.n_workers) as pool:
+            best_cs = list(pool.map(lambda split: self.select_c(x_train, y_train, split), splits))
+            distinct_cs = sorted(set(best_cs))
+            models = pool.map(lambda c: self.fit(x_train, y_train, [c])[0], distinct_cs)
+            scores = {c: accuracy(model, x_test, y_test) for c, model in zip(distinct_cs, models)}
+
+        return np.mean([scores[c] for c in best_cs])
+
+
+class RidgeProbeEval(LinearProbeEval):
+    name = 'ridge_probe_eval'
+
+    def fit(self, x, y, c_values):
+        """
+        Closed-form multiclass ridge regression on +-1 one-hot targets, with a
+        penalty of 1/C. A single eigendecomposition of the Gram matrix
+        gives the solution of every C.
+        """
+        classes = np.unique(y)
+        targets = np.where(y[:, None] == classes[None, :], 1., -1.)
+        x_mean, t_mean = x.mean(axis=0), targets.mean(axis=0)
+        xc = x - x_mean
+        eigenvalues, eigenvectors = np.linalg.eigh(xc.T.dot(xc))
+        projected = eigenvectors.T.dot(xc.T.dot(targets - t_mean))
+        models = []
+        for c in c_values:
+            W = eigenvectors.dot(projected / (eigenvalues + 1. / c)[:, None])
+            models.append((W, t_mean - x_mean.dot(W), classes))
+        return models
+
+
+class LogisticProbeEval(LinearProbeEval):
+    name = 'logistic_probe_eval'
+
+    def fit(self, x, y, c_values):
+        """
+        Logistic regression fit for increasing C values, each fit starting
+        from the solution of the previous, more regularized one
+        """
+        clf = LogisticRegression(solver='lbfgs', max_iter=200, warm_start=True)
+        models = {}
+        for c in sorted(c_values):
+            clf.set_params(C=c)
+            clf.fit(x, y)
+            models[c] = (clf.coef_.T.copy(), clf.intercept_.copy(), clf.classes_)
+        return [models[c] for c in c_values]
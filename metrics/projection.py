@@ -9,6 +9,7 @@ from core.metrics import ProjectionMetric
 class TSNEProjection(ProjectionMetric):
     name = 'tsne'
     input_type = 'labelled_embedding'
+    process_safe = True
 
     def compute(self, input_data):
         if len(input_data) == 2:
@@ -28,6 +29,7 @@ class TSNEProjection(ProjectionMetric):
 class LDAProjection(ProjectionMetric):
     name = 'lda'
     input_type = 'labelled_embedding'
+    process_safe = True
 
     def compute(self, input_data):
         if len(input_data) == 2:
@@ -46,6 +48,7 @@ class LDAProjection(ProjectionMetric):
 class PCAProjection(ProjectionMetric):
     name = 'pca'
     input_type = 'labelled_embedding'
+    process_safe = True
 
     def compute(self, input_data):
         if len(input_data) == 2:
@@ -9,6 +9,7 @@ from core.metrics import HistoryMetric
 class SVMEval(HistoryMetric):
     name = 'svm_eval'
     input_type = 'labelled_embedding'
+    process_safe = True
 
     def compute(self, input_data):
         if len(input_data) == 2:
@@ -46,6 +47,7 @@ class SVMEval(HistoryMetric):
 class SVMRBFEval(HistoryMetric):
     name = 'svm_rbf_eval'
     input_type = 'labelled_embedding'
+    process_safe = True
 
     def compute(self, input_data):
         if len(input_data) == 2:
@@ -11,6 +11,7 @@ import keras.backend as K
 
 from core.metrics import HistoryMetric
 from metrics import inception_score
+from metrics import fid
 from metrics import mmd
 
 
@@ -41,6 +42,25 @@ class InceptionScore(HistoryMetric):
         return mean
 
 
+class FrechetInceptionDistance(HistoryMetric):
+    name = 'fid'
+    input_type = 'generated_and_real_samples'
+
+    def __init__(self, fid_stats_dir=fid.STATS_DIR, **kwargs):
+        super().__init__()
+        self.stats_dir = fid_stats_dir
+        self.real_stats = {}
+
+    def compute(self, input_data):
+        x_hat, x = input_data
+        # the real samples are the same at every notify, only hash them
+        key = fid.get_stats_key(x)
+        if key not in self.real_stats:
+            self.real_stats[key] = fid.get_real_statistics(to_rgb(x), key, self.stats_dir)
+        mu, sigma = fid.get_statistics(inception_score.get_scorer().get_activations(to_rgb(x_hat)))
+        return fid.frechet_distance(mu, sigma, *self.real_stats[key])
+
+
 class RemoteInceptionScore(HistoryMetric):
     name = 'r_inception_score'
     input_type = 'generated_and_real_samples'
@@ -75,15 +95,29 @@ class MaximumMeanDiscrepancy(HistoryMetric):
     name = 'mmd'
     input_type = 'generated_and_real_samples'
 
-    def __init__(self, input_shape=(32, 32, 1), **kwargs):
+    def __init__(self, input_shape=(32, 32, 1), mmd_sigmas=None, mmd_block_size=1000, **kwargs):
+        super().__init__()
+        self.sigmas = mmd_sigmas or [1.]
+        self.blocked_mmd = mmd.BlockedMMD(int(np.prod(input_shape)), sigmas=self.sigmas,
+                                          block_size=mmd_block_size)
+
+    def compute(self, input_data):
+        x_hat, x = input_data
+        # blocked quadratic-time estimate, the kernel is the sum of the RBF
+        # kernels of every sigma
+        return np.log(np.sum(self.blocked_mmd.mmd2(K.get_session(), x, x_hat)))
+
+
+class LinearMaximumMeanDiscrepancy(HistoryMetric):
+    name = 'mmd_linear'
+    input_type = 'generated_and_real_samples'
+
+    def __init__(self, mmd_sigmas=None, **kwargs):
         super().__init__()
-        x_ph = tf.placeholder(tf.float32, shape=[None] + list(input_shape), name='mmd_x')
-        x_hat_ph = tf.placeholder(tf.float32, shape=[None] + list(input_shape), name='mmd_x_hat')
-        x_flat = K.batch_flatten(x_ph)
-        x_hat_flat = K.batch_flatten(x_hat_ph)
-        self.mmd_computer = tf.log(mmd.rbf_mmd2(x_flat, x_hat_flat))
+        self.sigmas = mmd_sigmas or [1.]
 
     def compute(self, input_data):
         x_hat, x = input_data
-        mmd = K.get_session().run(self.mmd_computer, feed_dict={'mmd_x:0': x, 'mmd_x_hat:0': x_hat})
-        return mmd
+        # linear-time unbiased estimate, possibly negative, so not in log
+        # scale and not comparable to mmd
+        return np.sum(mmd.linear_mmd2(x, x_hat, sigmas=self.sigmas))
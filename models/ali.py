@@ -50,6 +50,8 @@ def generator_lossfun(y_true, y_pred):
 
 
 class ALI(BaseModel, metaclass=ABCMeta):
+    supports_fused_step = True
+
     def __init__(self,
                  input_shape=(64, 64, 3),
                  z_dims=128,
@@ -72,6 +74,7 @@ class ALI(BaseModel, metaclass=ABCMeta):
         self.auxiliary_classifier = kwargs.get('auxiliary_classifier', False)
         self.conditional_dims = kwargs.get('conditional_dims', 0)
         self.conditionals_for_samples = kwargs.get('conditionals_for_samples', False)
+        self.fused_step = kwargs.get('fused_step', False)
 
         self.last_losses = {
             'g_loss': 10.,
@@ -97,13 +100,16 @@ class ALI(BaseModel, metaclass=ABCMeta):
             input_data = [x_data, z_latent_dis]
 
         # train both networks
-        d_loss = self.dis_trainer.train_on_batch(input_data, y)
-        g_loss = self.gen_trainer.train_on_batch(input_data, y)
-        if self.last_losses['d_loss'] < self.dis_loss_control:
+        if self.fused_step:
+            d_loss, g_loss = self.fused_trainer.train_on_batch(input_data, y)
+        else:
+            d_loss = self.dis_trainer.train_on_batch(input_data, y)
             g_loss = self.gen_trainer.train_on_batch(input_data, y)
+        if self.last_losses['d_loss'] < self.dis_loss_control:
+            g_loss = self.train_generator_on_batch(input_data, y)
         if self.last_losses['d_loss'] < self.dis_loss_control*1e-5:
             for i in range(0, 5):
-                g_loss = self.gen_trainer.train_on_batch(input_data, y)
+                g_loss = self.train_generator_on_batch(input_data, y)
 
 
         self.last_d_loss = d_loss
@@ -115,6 +121,15 @@ class ALI(BaseModel, metaclass=ABCMeta):
         self.last_losses = losses
         return losses
 
+    def train_generator_on_batch(self, input_data, y):
+        """
+        Extra generator step, through the fused trainer's generator group
+        when fused_step is set so that G keeps a single optimizer state
+        """
+        if self.fused_step:
+            return self.fused_trainer.train_group_on_batch(1, input_data, y)
+        return self.gen_trainer.train_on_batch(input_data, y)
+
     def predict(self, z_samples):
         return self.f_Gx.predict(z_samples)
 
@@ -163,6 +178,14 @@ class ALI(BaseModel, metaclass=ABCMeta):
 
         self.dis_trainer.summary(); self.gen_trainer.summary()
 
+        # single-pass alternative to the two trainers above, sharing their
+        # optimizers: the trainers' own training functions are never built
+        if self.fused_step:
+            self.fused_trainer = FusedTrainer(self.build_ALI_trainer(), [
+                (opt_d, get_weights_to_train([self.f_D]), [loss_d], [1.]),
+                (opt_g, get_weights_to_train([self.f_Gz, self.f_Gx]), [loss_g], [1.]),
+            ])
+
         # Store trainers
         self.store_to_save('dis_trainer')
         self.store_to_save('gen_trainer')
@@ -66,6 +66,7 @@ def generator_lossfun(y_true, y_pred):
 
 
 class ALICE(BaseModel, metaclass=ABCMeta):
+    supports_fused_step = True
 
     def __init__(self,
                  input_shape=(64, 64, 3),
@@ -90,6 +91,7 @@ class ALICE(BaseModel, metaclass=ABCMeta):
         self.auxiliary_classifier = kwargs.get('auxiliary_classifier', False)
         self.conditional_dims = kwargs.get('conditional_dims', 0)
         self.conditionals_for_samples = kwargs.get('conditionals_for_samples', False)
+        self.fused_step = kwargs.get('fused_step', False)
 
         self.last_losses = {
             'g_loss': 10.,
@@ -116,13 +118,16 @@ class ALICE(BaseModel, metaclass=ABCMeta):
             input_data = [x_data, z_latent_dis]
 
         # train both networks
-        d_loss = self.dis_trainer.train_on_batch(input_data, y)
-        g_loss = self.gen_trainer.train_on_batch(input_data, y)
-        if self.last_losses['d_loss'] < self.dis_loss_control:
+        if self.fused_step:
+            d_loss, g_loss = self.fused_trainer.train_on_batch(input_data, y)
+        else:
+            d_loss = self.dis_trainer.train_on_batch(input_data, y)
             g_loss = self.gen_trainer.train_on_batch(input_data, y)
+        if self.last_losses['d_loss'] < self.dis_loss_control:
+            g_loss = self.train_generator_on_batch(input_data, y)
         if self.last_losses['d_loss'] < self.dis_loss_control * 1e-5:
             for i in range(0, 5):
-                g_loss = self.gen_trainer.train_on_batch(input_data, y)
+                g_loss = self.train_generator_on_batch(input_data, y)
 
         self.last_d_loss = d_loss
         losses = {
@@ -133,6 +138,15 @@ class ALICE(BaseModel, metaclass=ABCMeta):
         self.last_losses = losses
         return losses
 
+    def train_generator_on_batch(self, input_data, y):
+        """
+        Extra generator step, through the fused trainer's generator group
+        when fused_step is set so that G keeps a single optimizer state
+        """
+        if self.fused_step:
+            return self.fused_trainer.train_group_on_batch(1, input_data, y)
+        return self.gen_trainer.train_on_batch(input_data, y)
+
     def predict(self, z_samples):
         return self.f_Gx.predict(z_samples)
 
@@ -198,6 +212,14 @@ class ALICE(BaseModel, metaclass=ABCMeta):
         self.dis_trainer.summary()
         self.gen_trainer.summary()
 
+        # single-pass alternative to the two trainers above, sharing their
+        # optimizers: the trainers' own training functions are never built
+        if self.fused_step:
+            self.fused_trainer = FusedTrainer(self.build_ALI_trainer(), [
+                (opt_d, get_weights_to_train([self.f_D, self.f_D_cycle]), [loss_d], [1.]),
+                (opt_g, get_weights_to_train([self.f_Gz, self.f_Gx]), [loss_g], [1.]),
+            ])
+
         # Store trainers
         self.store_to_save('dis_trainer')
         self.store_to_save('gen_trainer')
@@ -288,6 +310,7 @@ def simple_generator_lossfun(y_true, y_pred):
 
 
 class ExplicitALICE(BaseModel, metaclass=ABCMeta):
+    supports_fused_step = True
 
     def __init__(self,
                  input_shape=(64, 64, 3),
@@ -311,6 +334,7 @@ class ExplicitALICE(BaseModel, metaclass=ABCMeta):
         self.auxiliary_classifier = kwargs.get('auxiliary_classifier', False)
         self.conditional_dims = kwargs.get('conditional_dims', 0)
         self.conditionals_for_samples = kwargs.get('conditionals_for_samples', False)
+        self.fused_step = kwargs.get('fused_step', False)
 
         self.last_losses = {
             'g_loss': 10.,
@@ -334,13 +358,16 @@ class ExplicitALICE(BaseModel, metaclass=ABCMeta):
         input_data = [x_data, z_latent_dis]
 
         # train both networks
-        _, d_loss, _ = self.dis_trainer.train_on_batch(input_data, [y, x_data])
-        _, g_loss, cycle_loss = self.gen_trainer.train_on_batch(input_data, [y, x_data])
-        if self.last_losses['d_loss'] < self.dis_loss_control:
+        if self.fused_step:
+            (_, d_loss, _), (_, g_loss, cycle_loss) = self.fused_trainer.train_on_batch(input_data, [y, x_data])
+        else:
+            _, d_loss, _ = self.dis_trainer.train_on_batch(input_data, [y, x_data])
             _, g_loss, cycle_loss = self.gen_trainer.train_on_batch(input_data, [y, x_data])
+        if self.last_losses['d_loss'] < self.dis_loss_control:
+            _, g_loss, cycle_loss = self.train_generator_on_batch(input_data, [y, x_data])
         if self.last_losses['d_loss'] < self.dis_loss_control * 1e-5:
             for i in range(0, 5):
-                _, g_loss, cycle_loss = self.gen_trainer.train_on_batch(input_data, [y, x_data])
+                _, g_loss, cycle_loss = self.train_generator_on_batch(input_data, [y, x_data])
 
         self.last_d_loss = d_loss
         losses = {
@@ -352,6 +379,15 @@ class ExplicitALICE(BaseModel, metaclass=ABCMeta):
         self.last_losses = losses
         return losses
 
+    def train_generator_on_batch(self, input_data, y):
+        """
+        Extra generator step, through the fused trainer's generator group
+        when fused_step is set so that G keeps a single optimizer state
+        """
+        if self.fused_step:
+            return self.fused_trainer.train_group_on_batch(1, input_data, y)
+        return self.gen_trainer.train_on_batch(input_data, y)
+
     def predict(self, z_samples):
         return self.f_Gx.predict(z_samples)
 
@@ -401,6 +437,14 @@ class ExplicitALICE(BaseModel, metaclass=ABCMeta):
         self.dis_trainer.summary()
         self.gen_trainer.summary()
 
+        # single-pass alternative to the two trainers above, sharing their
+        # optimizers: the trainers' own training functions are never built
+        if self.fused_step:
+            self.fused_trainer = FusedTrainer(self.build_ALI_trainer(), [
+                (opt_d, get_weights_to_train([self.f_D]), [loss_d, 'mae'], [1., 0.]),
+                (opt_g, get_weights_to_train([self.f_Gz, self.f_Gx]), [loss_g, 'mae'], [1., 1.]),
+            ])
+
         # Store trainers
         self.store_to_save('dis_trainer')
         self.store_to_save('gen_trainer')
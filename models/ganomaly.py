@@ -214,10 +214,10 @@ class GANomaly(BaseModel):
         np.random.seed()
 
         generated_images = self.g_z_xhat.predict(samples, batch_size=2000)
-        images_from_set = self.dataset.images[perm[:n]]
+        images_from_set = self.dataset.get_images(perm[:n])
 
         self.save_precomputed_features('generated_and_real_samples', generated_images, Y=images_from_set)
-        return images_from_set, generated_images
+        return generated_images, images_from_set
 
     def compute_generated_image_samples(self, n=36):
         np.random.seed(14)
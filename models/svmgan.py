@@ -138,7 +138,7 @@ class SupportVectorGAN(BaseModel, metaclass=ABCMeta):
             y_pos, y_neg = smooth_binary_labels(dataset_size, self.label_smoothing, one_sided_smoothing=False)
             y = np.stack((y_neg, y_pos), axis=1)
             z_latent_dis = np.random.normal(size=(dataset_size, self.z_dims))
-            x_feats = self.f_preprocessing.predict(self.dataset.images)
+            x_feats = self.f_preprocessing.predict(self.dataset.get_images(slice(None)))
             x_hat_feats = self.f_preprocessing.predict(
                 self.f_Gx.predict(z_latent_dis))
             x_concat = np.stack((x_hat_feats, x_feats), axis=1)
@@ -112,7 +112,7 @@ class SupportVectorWGAN(BaseModel, metaclass=ABCMeta):
             y_neg = -y_pos
             y = np.stack((y_neg, y_pos), axis=1)
             z_latent_dis = np.random.normal(size=(dataset_size, self.z_dims))
-            x_feats = self.f_preprocessing.predict(self.dataset.images)
+            x_feats = self.f_preprocessing.predict(self.dataset.get_images(slice(None)))
             x_hat_feats = self.f_preprocessing.predict(
                 self.f_Gx.predict(z_latent_dis))
             x_concat = np.stack((x_hat_feats, x_feats), axis=1)
@@ -266,7 +266,7 @@ class TOPGANwithAEfromBEGAN(BaseModel):
         images_from_set, _ = self.dataset.get_random_fixed_batch(n)
 
         self.save_precomputed_features('generated_and_real_samples', generated_images, Y=images_from_set)
-        return images_from_set, generated_images
+        return generated_images, images_from_set
 
     def compute_generated_image_samples(self, n=36):
         np.random.seed(14)
@@ -27,6 +27,7 @@ def triplet_lossfun_creator(margin=1., zdims=256):
 
 
 class TripletALICE(BaseModel):
+    supports_fused_step = True
 
     def __init__(self,
                  submodels=['alice_mnist', 'alice_svhn'],
@@ -35,8 +36,10 @@ class TripletALICE(BaseModel):
         kwargs['name'] = 'triplet_alice'
         super().__init__(*args, **kwargs)
 
-        self.alice_d1 = models.models[submodels[0]](*args, **kwargs)
-        self.alice_d2 = models.models[submodels[1]](*args, **kwargs)
+        # the submodels are only trained through this model's trainers
+        submodel_kwargs = dict(kwargs, fused_step=False)
+        self.alice_d1 = models.models[submodels[0]](*args, **submodel_kwargs)
+        self.alice_d2 = models.models[submodels[1]](*args, **submodel_kwargs)
 
         # create local references to ease model saving and loading
         self.d1_f_D = self.alice_d1.f_D
@@ -59,6 +62,7 @@ class TripletALICE(BaseModel):
         self.triplet_margin = kwargs.get('triplet_margin', 1.0)
         self.triplet_weight = kwargs.get('triplet_weight', 1.0)
         self.submodels_weights = kwargs.get('submodels_weights', None)
+        self.fused_step = kwargs.get('fused_step', False)
 
         self.triplet_losses = []
         self.recompiled = False
@@ -86,8 +90,11 @@ class TripletALICE(BaseModel):
             input_data = [a_x, p_x, n_x, z_latent_dis]
 
         # train both networks
-        d_loss = self.dis_trainer.train_on_batch(input_data, y)
-        g_loss = self.gen_trainer.train_on_batch(input_data, y)
+        if self.fused_step:
+            d_loss, g_loss = self.fused_trainer.train_on_batch(input_data, y)
+        else:
+            d_loss = self.dis_trainer.train_on_batch(input_data, y)
+            g_loss = self.gen_trainer.train_on_batch(input_data, y)
 
         gen_loss = g_loss[1] + g_loss[2]
         dis_loss = d_loss[0]
@@ -214,6 +221,20 @@ class TripletALICE(BaseModel):
         self.dis_trainer.summary()
         self.gen_trainer.summary()
 
+        # single-pass alternative to the two trainers above, sharing their
+        # optimizers: the trainers' own training functions are never built
+        if self.fused_step:
+            self.fused_trainer = FusedTrainer(self.build_trainer(), [
+                (opt_d,
+                 get_weights_to_train([self.alice_d1.f_D, self.alice_d2.f_D,
+                                       self.alice_d1.f_D_cycle, self.alice_d2.f_D_cycle]),
+                 [loss_d, loss_d, loss_triplet], [1., 1., 0.]),
+                (opt_g,
+                 get_weights_to_train([self.alice_d1.f_Gx, self.alice_d1.f_Gz,
+                                       self.alice_d2.f_Gx, self.alice_d2.f_Gz]),
+                 [loss_g, loss_g, loss_triplet], [1., 1., self.triplet_weight]),
+            ])
+
         # Store trainers
         self.store_to_save('dis_trainer')
         self.store_to_save('gen_trainer')
@@ -373,18 +373,7 @@ class TripletALICEwithLCCandDS(BaseModel):
             print("Loaded submodels' weights.")
             return
 
-        for k, v in self.trainers.items():
-            try:
-                filename = os.path.join(folder, "{}.hdf5".format(k))
-                getattr(self, k).load_weights(filename)
-            except OSError:
-                print("Couldn't load {}. Starting from scratch".format(filename))
-            except ValueError:
-                print("Couldn't load {}. Starting from scratch".format(filename))
-
-        # load epoch number
-        epoch = int(folder.split('_')[-1].replace('/', ''))
-        self.last_epoch = epoch
+        super().load_model(folder)
 
     # def build_d_latent_cycle(self):
 
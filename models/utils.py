@@ -1,3 +1,4 @@
+import keras
 from keras import backend as K
 from keras.callbacks import Callback
 import os
@@ -29,6 +30,147 @@ def set_trainable(model, train):
             l.trainable = train
 
 
+def get_weights_to_train(models):
+    """
+    Returns the weights set_trainable(models, True) would expose to an
+    optimizer, leaving the trainable flags as they were
+    """
+    weights = []
+    for model in models:
+        was_trainable = [model.trainable] + [l.trainable for l in model.layers]
+        set_trainable(model, True)
+        weights += model.trainable_weights
+        model.trainable = was_trainable[0]
+        for l, trainable in zip(model.layers, was_trainable[1:]):
+            l.trainable = trainable
+    return weights
+
+
+class FusedTrainer(object):
+    """
+    Trains several roles of an adversarial model (e.g. discriminator and
+    generator) with a single forward pass. Every group is a tuple
+    (optimizer, weights, losses, loss_weights) where losses has one loss
+    function per output of model; all the groups are updated at once from
+    the same graph run. train_on_batch returns one result per group, in the
+    format Keras' train_on_batch would for a model compiled with that
+    group's losses. train_group_on_batch updates a single group, with the
+    same optimizer state, e.g. for extra generator steps.
+    """
+
+    def __init__(self, model, groups):
+        self.model = model
+        self.targets = [K.placeholder(ndim=K.ndim(o)) for o in model.outputs]
+        self.optimizers = [optimizer for optimizer, _, _, _ in groups]
+        self.group_outputs, self.group_updates = [], []
+        for optimizer, weights, losses, loss_weights in groups:
+            terms = [K.mean(keras.losses.get(loss)(t, o))
+                     for loss, t, o in zip(losses, self.targets, model.outputs)]
+            total = sum(w * term for w, term in zip(loss_weights, terms))
+            # regularization losses, as Model.compile adds them
+            for regularization_loss in model.losses:
+                total += regularization_loss
+            self.group_updates.append(optimizer.get_updates(loss=total, params=weights))
+            self.group_outputs.append([total] + terms if len(terms) > 1 else [total])
+
+        self.inputs = model.inputs + self.targets
+        self.learning_phase = []
+        if model.uses_learning_phase and not isinstance(K.learning_phase(), int):
+            self.inputs.append(K.learning_phase())
+            self.learning_phase = [1]
+        self.function = K.function(self.inputs, sum(self.group_outputs, []),
+                                   updates=list(model.updates) + sum(self.group_updates, []))
+        self.group_functions = {}
+
+    def _format(self, outputs):
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def train_on_batch(self, x, y):
+        x = x if isinstance(x, list) else [x]
+        y = y if isinstance(y, list) else [y]
+        values = self.function(x + y + self.learning_phase)
+        results, i = [], 0
+        for outputs in self.group_outputs:
+            results.append(self._format(values[i:i + len(outputs)]))
+            i += len(outputs)
+        return results
+
+    def train_group_on_batch(self, group, x, y):
+        if group not in self.group_functions:
+            self.group_functions[group] = K.function(
+                self.inputs, self.group_outputs[group],
+                updates=list(self.model.updates) + self.group_updates[group])
+        x = x if isinstance(x, list) else [x]
+        y = y if isinstance(y, list) else [y]
+        return self._format(self.group_functions[group](x + y + self.learning_phase))
+
+
+class CallableTrainer(object):
+    """
+    Runs the train function of a compiled model through a session callable.
+    Model.train_on_batch checks and converts its inputs and builds a
+    feed_dict on every call, a large share of a step of a small model; here
+    inputs are only cast to the dtypes of the placeholders. train_on_batch
+    returns what the model's train_on_batch would.
+    """
+
+    def __init__(self, model):
+        model._make_train_function()
+        function = model.train_function
+        self.n_outputs = len(function.outputs)
+        self.n_sample_weights = len(model._feed_sample_weights)
+        self.dtypes = [K.dtype(t) for t in function.inputs]
+        self.learning_phase = []
+        if model.uses_learning_phase and not isinstance(K.learning_phase(), int):
+            self.learning_phase = [1]
+        self.sample_weights = {}
+        self.callable = K.get_session().make_callable(function.outputs + [function.updates_op],
+                                                      feed_list=function.inputs)
+
+    def train_on_batch(self, x, y):
+        x = x if isinstance(x, list) else [x]
+        y = y if isinstance(y, list) else [y]
+        batchsize = len(x[0])
+        if batchsize not in self.sample_weights:
+            self.sample_weights[batchsize] = [np.ones(batchsize, dtype='float32')] * self.n_sample_weights
+        values = x + y + self.sample_weights[batchsize] + self.learning_phase
+        outputs = self.callable(*[np.asarray(v, dtype=d) for v, d in zip(values, self.dtypes)])
+        outputs = outputs[:self.n_outputs]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def use_callable_trainer(model):
+    """
+    Makes model.train_on_batch run through a CallableTrainer, built on its
+    first call: the train function of a model that is never trained on, e.g.
+    the trainers replaced by a fused trainer, is never built
+    """
+    trainer = []
+
+    def train_on_batch(x, y):
+        if not trainer:
+            trainer.append(CallableTrainer(model))
+        return trainer[0].train_on_batch(x, y)
+    model.train_on_batch = train_on_batch
+
+
+def stage_batches(batches, steps):
+    """
+    Groups the (x, y, cursor) items of a batch generator by steps, yielding
+    (x_batches, y_batches, last cursor); the last group of an epoch may be
+    shorter
+    """
+    x_batches, y_batches = [], []
+    for x_batch, y_batch, batch_index in batches:
+        x_batches.append(x_batch)
+        y_batches.append(y_batch)
+        if len(x_batches) == steps:
+            yield x_batches, y_batches, batch_index
+            x_batches, y_batches = [], []
+    if x_batches:
+        yield x_batches, y_batches, batch_index
+
+
 def get_gradient_norm_func(model):
     # https://github.com/keras-team/keras/issues/2226
     weights = model.trainable_weights  # weight tensors
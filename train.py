@@ -27,6 +27,12 @@ def main():
     parser.add_argument('--run-id', '-r', required=True)
     parser.add_argument('--checkpoint-every', default='1.', type=str)
     parser.add_argument('--notify-every', default='1.', type=str)
+    parser.add_argument('--checkpoint-keep-last', default=None, type=int,
+                        help="number of latest checkpoints kept, at least 1 (all if not given)")
+    parser.add_argument('--checkpoint-keep-every', default=None, type=int,
+                        help="also keep every n-th checkpoint")
+    parser.add_argument('--checkpoint-keep-best', default=None, type=str,
+                        help="also keep the best checkpoint by a metric or loss, in format name[:min|max]")
     parser.add_argument('--lr', default=1e-4, type=float)
     parser.add_argument('--dis-loss-control', default=1., type=float)
     parser.add_argument('--triplet-weight', default=1., type=float)
@@ -36,8 +42,36 @@ def main():
                         help="strings in format loss_name:weight:control_type:pivot_epoch")
     parser.add_argument('--metrics', type=str, nargs='+',
                         help="selection of metrics you want to calculate")
+    parser.add_argument('--mmd-sigmas', type=float, nargs='+', default=[1.],
+                        help="bandwidths of the RBF kernels summed by the mmd and mmd_linear metrics")
+    parser.add_argument('--mmd-block-size', default=1000, type=int,
+                        help="rows and columns of the kernel blocks of the quadratic-time MMD")
+    parser.add_argument('--metric-workers', default=0, type=int,
+                        help="worker processes computing the CPU heavy metrics (0 keeps them in threads)")
+    parser.add_argument('--metric-timeouts', type=str, nargs='+',
+                        help="limits of metric computations in worker processes, "
+                             "in format seconds or metric_name:seconds")
     parser.add_argument('--wgan-n-critic', default=5, type=int)
     parser.add_argument('--began-gamma', default=0.5, type=float)
+    parser.add_argument('--prefetch-batches', default=0, type=int,
+                        help="number of batches assembled ahead in background threads (0 disables)")
+    parser.add_argument('--prefetch-workers', default=1, type=int,
+                        help="number of threads assembling prefetched batches")
+    parser.add_argument('--uint8-storage', action='store_true',
+                        help="keep in-memory datasets as uint8 and normalize per batch")
+    parser.add_argument('--no-dataset-cache', action='store_true',
+                        help="always preprocess datasets from the raw files")
+    parser.add_argument('--shuffle-pool', default=20000, type=int,
+                        help="rows kept in memory to shuffle datasets streamed from disk")
+    parser.add_argument('--profile-every', default=0, type=int,
+                        help="print a per-phase timing summary every n batches (0 disables)")
+    parser.add_argument('--profile-trace', default=None, type=str,
+                        help="file receiving a Chrome trace of the profiled phases")
+    parser.add_argument('--fused-step', action='store_true',
+                        help="update D and G from a single forward pass (ALI/ALICE models)")
+    parser.add_argument('--staged-batches', default=1, type=int,
+                        help="batches staged per iteration of the training loop, whose bookkeeping "
+                             "is done once per group; every batch is still a training step of its own")
 
     args = parser.parse_args()
 
@@ -55,7 +89,9 @@ def main():
         os.mkdir(args.output)
 
     # load datasets
-    dataset = load_dataset(args.dataset)
+    dataset = load_dataset(args.dataset, uint8_storage=args.uint8_storage,
+                           use_cache=not args.no_dataset_cache,
+                           shuffle_pool=args.shuffle_pool)
 
     model = models.get_model_by_name(args.model)(
         input_shape=dataset.shape[1:],
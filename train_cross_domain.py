@@ -45,6 +45,8 @@ def main():
     parser.add_argument('--resume-submodels', nargs=2,
                         help="Submodels pretrained weights")
     parser.add_argument('--dis-loss-control', default=1., type=float)
+    parser.add_argument('--fused-step', action='store_true',
+                        help="update D and G from a single forward pass (triplet_alice only)")
 
     args = parser.parse_args()
 
@@ -87,6 +89,7 @@ def main():
         submodels=args.submodels,
         dis_loss_control=args.dis_loss_control,
         submodels_weights=args.resume_submodels,
+        fused_step=args.fused_step,
         permutation_matrix_shape=(len(dataset), dataset.mirror_len)
     )
 